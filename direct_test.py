@@ -2,8 +2,14 @@ import os
 import json
 import serial
 import time
+import random
 from datetime import datetime
 
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; fall back to the random module
+    np = None
+
 print("=== GPS Fix Test ===")
 print(f"OS: {os.name}")
 
@@ -32,16 +38,34 @@ except (OSError, serial.SerialException) as e:
     print(f"⚠ GPS port not available: {e}")
     print("✓ Using simulated GPS data instead")
 
+# Pre-generated offsets (lat, lon, alt, speed), served round-robin
+SIM_POOL_SIZE = 4096  # power of two so the index can be masked
+
+def _build_sim_pool():
+    if np is not None:
+        rng = np.random.default_rng()
+        pool = (rng.uniform(size=(SIM_POOL_SIZE, 4)) * np.array([0.002, 0.002, 10, 5])
+                - np.array([0.001, 0.001, 5, 0]))
+        return [tuple(row) for row in pool.tolist()]
+    return [(random.uniform(-0.001, 0.001), random.uniform(-0.001, 0.001),
+             random.uniform(-5, 5), random.uniform(0, 5))
+            for _ in range(SIM_POOL_SIZE)]
+
+_SIM_POOL = _build_sim_pool()
+_SIM_IDX = 0
+
 # Test simulated GPS data
 def get_simulated_location():
-    import random
+    global _SIM_IDX
+    d_lat, d_lon, d_alt, speed = _SIM_POOL[_SIM_IDX & (SIM_POOL_SIZE - 1)]
+    _SIM_IDX += 1
     base_lat = 40.7128
     base_lon = -74.0060
     return {
-        'latitude': base_lat + random.uniform(-0.001, 0.001),
-        'longitude': base_lon + random.uniform(-0.001, 0.001),
-        'altitude': 10.0 + random.uniform(-5, 5),
-        'speed': random.uniform(0, 5),
+        'latitude': base_lat + d_lat,
+        'longitude': base_lon + d_lon,
+        'altitude': 10.0 + d_alt,
+        'speed': speed,
         'timestamp': datetime.now(),
         'fix_quality': 1,
         'satellites': 8,
@@ -8,6 +8,11 @@ import serial
 import time
 import sys
 import os
+import grp
+import pwd
+
+# Position sentences worth echoing, GPS-only and multi-GNSS talkers alike
+_NMEA_WANTED = frozenset({'GPGGA', 'GPRMC', 'GNGGA', 'GNRMC'})
 
 def test_gps():
     """Test GPS module on /dev/ttyS0"""
@@ -24,18 +29,16 @@ def test_gps():
         start_time = time.time()
         nmea_count = 0
         
+        # readline() blocks in the kernel until a full sentence (or the port
+        # timeout) arrives, so there is no sleep quantum between bursts
         while time.time() - start_time < 10:
-            if gps.in_waiting > 0:
-                data = gps.read(gps.in_waiting).decode('ascii', errors='ignore')
-                lines = data.strip().split('\n')
-                for line in lines:
-                    if line.startswith('$'):
-                        nmea_count += 1
-                        if line.startswith('$GPGGA') or line.startswith('$GPRMC'):
-                            print(f"  📍 {line}")
-                        elif nmea_count <= 5:  # Show first 5 NMEA sentences
-                            print(f"  📡 {line}")
-            time.sleep(0.1)
+            line = gps.readline().decode('ascii', errors='ignore').strip()
+            if line[:1] == '$':
+                nmea_count += 1
+                if line[1:6] in _NMEA_WANTED:
+                    print(f"  📍 {line}")
+                elif nmea_count <= 5:  # Show first 5 NMEA sentences
+                    print(f"  📡 {line}")
         
         if nmea_count > 0:
             print(f"✓ GPS working - received {nmea_count} NMEA sentences")
@@ -75,11 +78,7 @@ def test_gsm():
         # Test basic AT command
         print("Sending AT command...")
         gsm.write(b'AT\r\n')
-        time.sleep(1)
-        
-        response = ''
-        if gsm.in_waiting > 0:
-            response = gsm.read(gsm.in_waiting).decode('ascii', errors='ignore')
+        response = gsm.read_until(b'OK\r\n').decode('ascii', errors='ignore')
         
         if 'OK' in response:
             print("✓ GSM module responding")
@@ -87,19 +86,15 @@ def test_gsm():
             # Get module info
             print("Getting module info...")
             gsm.write(b'ATI\r\n')
-            time.sleep(1)
-            
-            if gsm.in_waiting > 0:
-                info = gsm.read(gsm.in_waiting).decode('ascii', errors='ignore')
+            info = gsm.read_until(b'OK\r\n').decode('ascii', errors='ignore')
+            if info:
                 print(f"  📱 {info.strip()}")
             
             # Check signal strength
             print("Checking signal strength...")
             gsm.write(b'AT+CSQ\r\n')
-            time.sleep(1)
-            
-            if gsm.in_waiting > 0:
-                signal = gsm.read(gsm.in_waiting).decode('ascii', errors='ignore')
+            signal = gsm.read_until(b'OK\r\n').decode('ascii', errors='ignore')
+            if signal:
                 print(f"  📶 {signal.strip()}")
             
             print("✓ GSM module working")
@@ -132,21 +127,23 @@ def check_permissions():
     print("PERMISSIONS CHECK")
     print("=" * 50)
     
-    import os
     user = os.getenv('USER')
     
-    # Check if user is in dialout group
+    # Check if user is in dialout group (as a member or as primary group)
     try:
-        with open('/etc/group', 'r') as f:
-            groups = f.read()
-            if f'dialout:x:' in groups and user in groups:
-                print(f"✓ User {user} is in dialout group")
-            else:
-                print(f"✗ User {user} is NOT in dialout group")
-                print("  Run: sudo usermod -a -G dialout $USER")
-                print("  Then logout and login again")
-    except:
-        print("✗ Could not check group membership")
+        dialout = grp.getgrnam('dialout')
+        in_dialout = user in dialout.gr_mem
+        if not in_dialout and user:
+            in_dialout = pwd.getpwnam(user).pw_gid == dialout.gr_gid
+    except KeyError:
+        in_dialout = False
+    
+    if in_dialout:
+        print(f"✓ User {user} is in dialout group")
+    else:
+        print(f"✗ User {user} is NOT in dialout group")
+        print("  Run: sudo usermod -a -G dialout $USER")
+        print("  Then logout and login again")
     
     # Check serial port permissions
     for port in ['/dev/ttyS0', '/dev/ttyUSB0']:
@@ -10,29 +10,197 @@ import time
 import json
 import sqlite3
 import threading
+import queue
 import logging
-from datetime import datetime
+import logging.handlers
+from datetime import datetime, timedelta, timezone
 import pynmea2
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
+import re
+import math
+import select
+import struct
 from signal import signal, SIGINT
 from sys import exit
 
+INSERT_LOCATION_SQL = '''
+    INSERT INTO locations 
+    (patient_id, lat_e7, lon_e7, alt_mm, speed_mms, timestamp, accuracy)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Fixed-point location columns: 1e-7 degrees (~1cm) and millimetres fit
+# in SQLite's 4-byte integer encoding, half the size of a REAL
+LOCATION_INT_COLUMNS = (
+    ('lat_e7', 'INTEGER'),
+    ('lon_e7', 'INTEGER'),
+    ('alt_mm', 'INTEGER'),
+    ('speed_mms', 'INTEGER'),
+)
+
+# Older rows keep their REAL values; newer rows only fill the integer columns
+CREATE_LOCATIONS_VIEW_SQL = '''
+    CREATE VIEW IF NOT EXISTS locations_view AS
+    SELECT id, patient_id,
+           COALESCE(latitude, lat_e7 / 1e7) AS latitude,
+           COALESCE(longitude, lon_e7 / 1e7) AS longitude,
+           COALESCE(altitude, alt_mm / 1e3) AS altitude,
+           COALESCE(speed, speed_mms / 1e3) AS speed,
+           timestamp, accuracy
+    FROM locations
+'''
+
+def _fixed(value, scale):
+    """Scale a float to a rounded integer, keeping None as NULL"""
+    if value is None:
+        return None
+    return int(round(value * scale))
+
+# Position sentences we use, GPS-only and multi-GNSS talkers alike
+_NMEA_WANTED = frozenset({'GPGGA', 'GPRMC', 'GNGGA', 'GNRMC'})
+
+# u-blox UBX binary protocol (NEO-6M): NAV-POSLLH and NAV-SOL per epoch
+UBX_SYNC = b'\xb5\x62'
+UBX_NAV_POSLLH = (0x01, 0x02)
+UBX_NAV_SOL = (0x01, 0x06)
+UBX_NMEA_IDS = (0x00, 0x01, 0x02, 0x03, 0x04, 0x05)  # GGA GLL GSA GSV RMC VTG
+
+def _ubx_checksum(data):
+    """8-bit Fletcher checksum over class, id, length and payload"""
+    ck_a = ck_b = 0
+    for byte in data:
+        ck_a = (ck_a + byte) & 0xFF
+        ck_b = (ck_b + ck_a) & 0xFF
+    return bytes((ck_a, ck_b))
+
+def _ubx_frame(msg_class, msg_id, payload=b''):
+    """Build a complete UBX frame"""
+    body = struct.pack('<BBH', msg_class, msg_id, len(payload)) + payload
+    return UBX_SYNC + body + _ubx_checksum(body)
+
+# Pre-encoded AT commands used on every start-up and alert
+AT_COMMANDS = {
+    'AT': b'AT\r\n',
+    'ATI': b'ATI\r\n',
+    'AT+CSQ': b'AT+CSQ\r\n',
+    'AT+CMGF=1': b'AT+CMGF=1\r\n',
+    '': b'\r\n',
+}
+SMS_TERMINATOR = b'\x1A'
+GSM_FINAL = (b'OK\r\n', b'ERROR\r\n')
+SMS_PROMPT = (b'> ', b'ERROR\r\n')
+
+DB_PATH = 'patient_tracking.db'
+
+INSERT_ALERT_SQL = '''
+    INSERT INTO alerts 
+    (patient_id, alert_type, message, latitude, longitude, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+def adapt_utc(value):
+    """Store datetimes as fixed-width UTC text, so string order is time order"""
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%fZ')
+
+sqlite3.register_adapter(datetime, adapt_utc)
+
+# Buffered locations are written in one transaction once either limit is hit;
+# alerts are written as soon as the writer sees them
+LOCATION_FLUSH_SIZE = 32
+LOCATION_FLUSH_SECONDS = 10
+DB_QUEUE_SIZE = 1024
+DB_BATCH_SIZE = 64
+
+# Longest single wait on the GPS ring, so a stop request is seen within this
+GPS_STOP_POLL = 0.5  # seconds
+
+class ByteRingBuffer:
+    """Fixed-size byte ring between a serial reader and its parser
+
+    When the parser falls behind, the oldest bytes are overwritten so the
+    buffer always holds the most recent data from the receiver.
+    """
+    def __init__(self, size=16384):
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._size = size
+        self._head = 0
+        self._count = 0
+        self._cond = threading.Condition()
+    
+    def write(self, data):
+        """Append bytes, wrapping around the end of the buffer"""
+        data = memoryview(data)[-self._size:]
+        n = len(data)
+        with self._cond:
+            first = min(n, self._size - self._head)
+            self._view[self._head:self._head + first] = data[:first]
+            self._view[:n - first] = data[first:]
+            self._head = (self._head + n) % self._size
+            self._count = min(self._count + n, self._size)
+            self._cond.notify()
+    
+    def read(self, timeout=None):
+        """Drain all buffered bytes, waiting up to timeout if empty"""
+        with self._cond:
+            if not self._count:
+                self._cond.wait(timeout)
+            tail = (self._head - self._count) % self._size
+            end = tail + self._count
+            if end <= self._size:
+                data = bytes(self._view[tail:end])
+            else:
+                data = bytes(self._view[tail:]) + bytes(self._view[:end - self._size])
+            self._count = 0
+            return data
+
 class PatientTracker:
     def __init__(self):
         # Configuration
         self.config = self.load_config()
+        self.cache_geofence()
         
         # Serial ports
         self.gps_port = None
         self.gsm_port = None
+        self.gsm_poller = None
         
-        # Database
-        self.db_conn = None
+        # A reader thread fills the ring continuously; get_gps_location drains it
+        self._gps_ring = ByteRingBuffer()
+        self._gps_reader_stop = threading.Event()
+        
+        # NMEA framing persists across reads so split sentences survive
+        self._nmea = pynmea2.NMEAStreamReader(errors='ignore')
+        
+        # UBX framing state, used when gps_protocol is "ubx"
+        self._ubx_buf = bytearray()
+        self._ubx_posllh = None
+        
+        # UTC date from the last RMC sentence, GGA only carries time of day
+        self._gps_date = None
+        self._gps_date_time = None  # time of day of the RMC that set _gps_date
+        
+        # Database writes go through one writer thread and its own connection
+        self._db_queue = queue.Queue(maxsize=DB_QUEUE_SIZE)
         
         # Tracking state
         self.is_tracking = False
         self.current_location = None
+        self._stop_event = threading.Event()
+        
+        # Uploads run on their own thread so a slow server never delays a fix
+        self._upload_queue = queue.Queue(maxsize=64)
+        
+        # One keep-alive connection to the server, reused for every upload
+        self.http = requests.Session()
+        self.http.headers.update({'Content-Type': 'application/json'})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1,
+                              max_retries=Retry(total=2, backoff_factor=0.5))
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
         self.patient_id = self.config.get('patient_id', 'PATIENT001')
         
         # Setup logging
@@ -53,6 +221,7 @@ class PatientTracker:
                 "patient_id": "PATIENT001",
                 "gps_port": "COM1" if os.name == 'nt' else "/dev/ttyS0",
                 "gps_baudrate": 9600,
+                "gps_protocol": "nmea",
                 "gsm_port": "COM2" if os.name == 'nt' else "/dev/ttyUSB0",
                 "gsm_baudrate": 115200,
                 "server_url": "http://your-server.com/api/location",
@@ -69,23 +238,42 @@ class PatientTracker:
                 json.dump(default_config, f, indent=4)
             return default_config
     
+    def cache_geofence(self):
+        """Precompute the fixed geofence center terms used on every fix"""
+        geofence = self.config['geofence']
+        self._gf_enabled = geofence['enabled']
+        self._gf_radius = geofence['radius']
+        self._gf_lat2 = math.radians(geofence['latitude'])
+        self._gf_lon2 = math.radians(geofence['longitude'])
+        self._gf_cos_lat2 = math.cos(self._gf_lat2)
+    
     def setup_logging(self):
         """Setup logging configuration"""
+        # Callers only enqueue records; a listener thread does the disk writes
+        log_queue = queue.Queue()
+        self._log_listener = logging.handlers.QueueListener(
+            log_queue,
+            logging.FileHandler('patient_tracker.log'),
+            logging.StreamHandler()
+        )
         logging.basicConfig(
             level=logging.INFO,
             format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler('patient_tracker.log'),
-                logging.StreamHandler()
-            ]
+            handlers=[logging.handlers.QueueHandler(log_queue)]
         )
+        self._log_listener.start()
         self.logger = logging.getLogger(__name__)
     
     def initialize_database(self):
         """Initialize SQLite database for storing location data"""
         try:
-            self.db_conn = sqlite3.connect('patient_tracking.db', check_same_thread=False)
-            cursor = self.db_conn.cursor()
+            conn = sqlite3.connect(DB_PATH)
+            conn.executescript('''
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                PRAGMA temp_store=MEMORY;
+            ''')
+            cursor = conn.cursor()
             
             # Create tables
             cursor.execute('''
@@ -101,6 +289,14 @@ class PatientTracker:
                 )
             ''')
             
+            # Add the fixed-point columns to databases created before them
+            cursor.execute('PRAGMA table_info(locations)')
+            existing = {row[1] for row in cursor.fetchall()}
+            for name, col_type in LOCATION_INT_COLUMNS:
+                if name not in existing:
+                    cursor.execute(f'ALTER TABLE locations ADD COLUMN {name} {col_type}')
+            cursor.execute(CREATE_LOCATIONS_VIEW_SQL)
+            
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS alerts (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -124,7 +320,12 @@ class PatientTracker:
                 )
             ''')
             
-            self.db_conn.commit()
+            conn.commit()
+            conn.close()
+            
+            self.db_writer_thread = threading.Thread(target=self.db_writer_loop)
+            self.db_writer_thread.daemon = True
+            self.db_writer_thread.start()
             self.logger.info("Database initialized successfully")
             
         except Exception as e:
@@ -141,6 +342,8 @@ class PatientTracker:
                 timeout=1
             )
             self.logger.info(f"GPS initialized on {self.config['gps_port']}")
+            if self.config.get('gps_protocol', 'nmea') == 'ubx':
+                self.configure_ubx()
             
             # Initialize GSM
             self.gsm_port = serial.Serial(
@@ -150,6 +353,14 @@ class PatientTracker:
             )
             self.logger.info(f"GSM initialized on {self.config['gsm_port']}")
             
+            # Keep draining the GPS UART between location updates
+            self.gps_reader_thread = threading.Thread(target=self.gps_reader_loop)
+            self.gps_reader_thread.daemon = True
+            self.gps_reader_thread.start()
+            
+            # Wake on data arrival instead of sleeping a fixed amount
+            self.gsm_poller = self.create_poller(self.gsm_port)
+            
             # Test GSM module
             self.test_gsm_module()
             
@@ -161,116 +372,291 @@ class PatientTracker:
         """Test GSM module connectivity"""
         try:
             self.send_gsm_command('AT')
-            response = self.send_gsm_command('ATI')
-            self.logger.info(f"GSM Module Info: {response}")
             
-            # Check signal strength
-            signal_strength = self.send_gsm_command('AT+CSQ')
+            # Module info, signal strength and text SMS mode in one round-trip
+            response, signal_strength, _ = self.send_gsm_commands(
+                ['ATI', 'AT+CSQ', 'AT+CMGF=1'])
+            self.logger.info(f"GSM Module Info: {response}")
             self.logger.info(f"Signal Strength: {signal_strength}")
             
-            # Set SMS mode to text
-            self.send_gsm_command('AT+CMGF=1')
-            
         except Exception as e:
             self.logger.error(f"GSM module test failed: {e}")
             raise
     
+    def create_poller(self, port):
+        """Register a serial port with epoll (Linux only, None elsewhere)"""
+        if not hasattr(select, 'epoll'):
+            return None
+        poller = select.epoll()
+        poller.register(port.fileno(), select.EPOLLIN)
+        return poller
+    
     def send_gsm_command(self, command, wait_time=1):
         """Send command to GSM module and return response"""
         try:
-            self.gsm_port.write((command + '\r\n').encode())
-            time.sleep(wait_time)
-            response = ''
-            while self.gsm_port.in_waiting > 0:
-                response += self.gsm_port.read(self.gsm_port.in_waiting).decode()
-            return response.strip()
+            self.gsm_port.write(AT_COMMANDS.get(command) or (command + '\r\n').encode())
+            return self.read_gsm_response(wait_time)
         except Exception as e:
             self.logger.error(f"GSM command failed: {command} - {e}")
             return ''
     
-    def parse_gps_data(self, gps_data):
-        """Parse NMEA GPS data"""
+    def send_gsm_commands(self, commands, wait_time=2):
+        """Pipeline several AT commands and return their responses in order"""
         try:
-            for line in gps_data.split('\n'):
-                if line.startswith('$GPGGA'):
-                    msg = pynmea2.parse(line)
-                    return {
-                        'latitude': msg.latitude,
-                        'longitude': msg.longitude,
-                        'altitude': msg.altitude,
-                        'timestamp': datetime.now(),
-                        'fix_quality': msg.gps_qual,
-                        'satellites': msg.num_sats
-                    }
-                elif line.startswith('$GPRMC'):
-                    msg = pynmea2.parse(line)
-                    return {
-                        'latitude': msg.latitude,
-                        'longitude': msg.longitude,
-                        'speed': msg.spd_over_grnd,
-                        'timestamp': datetime.now(),
-                        'fix_valid': msg.is_valid
-                    }
+            self.gsm_port.write(b''.join(
+                AT_COMMANDS.get(command) or (command + '\r\n').encode()
+                for command in commands))
+            response = self.read_gsm_response(wait_time, count=len(commands))
+        except Exception as e:
+            self.logger.error(f"GSM commands failed: {commands} - {e}")
+            response = ''
+        responses = [r.strip() for r in re.split(r'(?<=OK\r\n)|(?<=ERROR\r\n)', response)]
+        return (responses + [''] * len(commands))[:len(commands)]
+    
+    def read_gsm_response(self, timeout, count=1, terminators=GSM_FINAL):
+        """Collect GSM responses, returning once `count` terminators arrive"""
+        response = bytearray()
+        deadline = time.monotonic() + timeout
+        while sum(response.count(t) for t in terminators) < count:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if self.gsm_poller:
+                if not self.gsm_poller.poll(remaining):
+                    break
+                response += self.gsm_port.read(self.gsm_port.in_waiting or 1)
+            elif self.gsm_port.in_waiting > 0:
+                response += self.gsm_port.read(self.gsm_port.in_waiting)
+            else:
+                time.sleep(min(0.05, remaining))
+        return response.decode(errors='ignore').strip()
+    
+    def parse_gps_data(self, msg):
+        """Convert a parsed NMEA sentence into a location dict"""
+        try:
+            sentence_type = getattr(msg, 'sentence_type', '')
+            if getattr(msg, 'talker', '') + sentence_type not in _NMEA_WANTED:
+                return None
+            if sentence_type == 'GGA':
+                return {
+                    'latitude': msg.latitude,
+                    'longitude': msg.longitude,
+                    'altitude': msg.altitude,
+                    'timestamp': self.gps_timestamp(msg),
+                    'fix_quality': msg.gps_qual,
+                    'satellites': msg.num_sats
+                }
+            elif sentence_type == 'RMC':
+                return {
+                    'latitude': msg.latitude,
+                    'longitude': msg.longitude,
+                    'speed': msg.spd_over_grnd,
+                    'timestamp': self.gps_timestamp(msg),
+                    'fix_valid': msg.is_valid
+                }
         except Exception as e:
             self.logger.error(f"GPS parsing error: {e}")
         return None
     
+    def gps_timestamp(self, msg):
+        """UTC time of the fix as reported by the receiver itself.
+        
+        RMC carries the full date and time; GGA is combined with the date
+        from the last RMC, rolled forward when the GGA time of day is earlier
+        (UTC midnight passed since that RMC). System UTC is only used before
+        the first RMC.
+        """
+        stamp = getattr(msg, 'timestamp', None)
+        if stamp:
+            stamp = stamp.replace(tzinfo=None)
+        if getattr(msg, 'sentence_type', '') == 'RMC' and msg.datestamp:
+            self._gps_date = msg.datestamp
+            self._gps_date_time = stamp
+        if stamp and self._gps_date:
+            fix_time = datetime.combine(self._gps_date, stamp, timezone.utc)
+            if self._gps_date_time and stamp < self._gps_date_time:
+                fix_time += timedelta(days=1)
+            return fix_time
+        return datetime.now(timezone.utc)
+    
+    def configure_ubx(self):
+        """Switch the receiver to binary NAV-POSLLH/NAV-SOL output"""
+        frames = [_ubx_frame(0x06, 0x01, bytes((0xF0, msg_id, 0)))
+                  for msg_id in UBX_NMEA_IDS]
+        frames.append(_ubx_frame(0x06, 0x01, bytes(UBX_NAV_POSLLH + (1,))))
+        frames.append(_ubx_frame(0x06, 0x01, bytes(UBX_NAV_SOL + (1,))))
+        self.gps_port.write(b''.join(frames))
+        self.logger.info("GPS switched to UBX binary output")
+    
+    def parse_ubx(self, data):
+        """Decode UBX frames from raw bytes, returning the latest full fix"""
+        buf = self._ubx_buf
+        buf += data
+        location = None
+        while True:
+            start = buf.find(UBX_SYNC)
+            if start < 0:
+                del buf[:-1]
+                break
+            if len(buf) - start < 6:
+                del buf[:start]
+                break
+            msg_class, msg_id, length = struct.unpack_from('<BBH', buf, start + 2)
+            end = start + 6 + length + 2
+            if len(buf) < end:
+                del buf[:start]
+                break
+            body = bytes(buf[start + 2:end - 2])
+            checksum = bytes(buf[end - 2:end])
+            del buf[:end]
+            if _ubx_checksum(body) != checksum:
+                continue
+            location = self._decode_ubx(msg_class, msg_id, body[4:]) or location
+        return location
+    
+    def _decode_ubx(self, msg_class, msg_id, payload):
+        """Unpack NAV-POSLLH/NAV-SOL payloads; a fix is emitted once both
+        messages for the same epoch have been seen"""
+        key = (msg_class, msg_id)
+        if key == UBX_NAV_POSLLH and len(payload) >= 28:
+            self._ubx_posllh = struct.unpack_from('<IiiiiI', payload)
+        elif key == UBX_NAV_SOL and len(payload) >= 52:
+            itow, = struct.unpack_from('<I', payload)
+            gps_fix, flags = struct.unpack_from('<BB', payload, 10)
+            num_sv = payload[47]
+            pos = self._ubx_posllh
+            if pos is None or pos[0] != itow:
+                return None
+            if gps_fix not in (2, 3) or not flags & 0x01:
+                return None
+            _, lon, lat, _, h_msl, h_acc = pos
+            return {
+                'latitude': lat / 1e7,
+                'longitude': lon / 1e7,
+                'altitude': h_msl / 1000.0,
+                'timestamp': datetime.now(timezone.utc),
+                'fix_quality': 1,
+                'satellites': num_sv,
+                'accuracy': h_acc / 1000.0
+            }
+        return None
+    
+    def gps_reader_loop(self):
+        """Copy GPS bytes into the ring buffer as soon as they arrive"""
+        while not self._gps_reader_stop.is_set():
+            try:
+                data = self.gps_port.read(self.gps_port.in_waiting or 1)
+                if data:
+                    self._gps_ring.write(data)
+            except Exception as e:
+                if self._gps_reader_stop.is_set():
+                    break
+                self.logger.error(f"GPS reading error: {e}")
+                self._gps_reader_stop.wait(1)
+    
     def get_gps_location(self):
         """Get current GPS location"""
         try:
-            if self.gps_port.in_waiting > 0:
-                gps_data = self.gps_port.read(self.gps_port.in_waiting).decode()
-                location = self.parse_gps_data(gps_data)
-                if location:
-                    self.current_location = location
-                    return location
+            # Drain the reader thread's output until a full fix is framed,
+            # waiting at most one update interval; short waits let a stop
+            # request end the drain promptly
+            deadline = time.monotonic() + self.config['update_interval']
+            location = None
+            while location is None and not self._stop_event.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                data = self._gps_ring.read(timeout=min(remaining, GPS_STOP_POLL))
+                if self.config.get('gps_protocol', 'nmea') == 'ubx':
+                    location = self.parse_ubx(data) or location
+                    continue
+                for msg in self._nmea.next(data.decode('ascii', errors='ignore')):
+                    location = self.parse_gps_data(msg) or location
+            if location:
+                self.current_location = location
+                return location
         except Exception as e:
             self.logger.error(f"GPS reading error: {e}")
         return None
     
     def store_location(self, location):
-        """Store location data in database"""
+        """Queue location data for the database writer"""
+        row = (
+            self.patient_id,
+            _fixed(location.get('latitude'), 1e7),
+            _fixed(location.get('longitude'), 1e7),
+            _fixed(location.get('altitude'), 1e3),
+            _fixed(location.get('speed'), 1e3),
+            location.get('timestamp'),
+            location.get('accuracy', 10.0)
+        )
         try:
-            cursor = self.db_conn.cursor()
-            cursor.execute('''
-                INSERT INTO locations 
-                (patient_id, latitude, longitude, altitude, speed, timestamp, accuracy)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                self.patient_id,
-                location.get('latitude'),
-                location.get('longitude'),
-                location.get('altitude'),
-                location.get('speed'),
-                location.get('timestamp'),
-                location.get('accuracy', 10.0)
-            ))
-            self.db_conn.commit()
+            self._db_queue.put_nowait(('location', row))
+        except queue.Full:
+            self.logger.error("Database queue full, location dropped")
+    
+    def db_writer_loop(self):
+        """Apply queued writes in batches until a None sentinel arrives"""
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        locations, alerts = [], []
+        flush_at = None
+        running = True
+        while running:
+            timeout = None if flush_at is None else max(0.0, flush_at - time.monotonic())
+            try:
+                batch = [self._db_queue.get(timeout=timeout)]
+            except queue.Empty:
+                batch = []
+            while batch and len(batch) < DB_BATCH_SIZE:
+                try:
+                    batch.append(self._db_queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            for item in batch:
+                if item is None:
+                    running = False
+                    continue
+                kind, row = item
+                (alerts if kind == 'alert' else locations).append(row)
+            if locations and flush_at is None:
+                flush_at = time.monotonic() + LOCATION_FLUSH_SECONDS
+            
+            if (not running or alerts or len(locations) >= LOCATION_FLUSH_SIZE or
+                    (flush_at is not None and time.monotonic() >= flush_at)):
+                self._write_batch(conn, locations, alerts)
+                locations, alerts = [], []
+                flush_at = None
+        conn.close()
+    
+    def _write_batch(self, conn, locations, alerts):
+        """Write a batch of rows in a single transaction"""
+        try:
+            with conn:
+                if locations:
+                    conn.executemany(INSERT_LOCATION_SQL, locations)
+                if alerts:
+                    conn.executemany(INSERT_ALERT_SQL, alerts)
         except Exception as e:
             self.logger.error(f"Database storage error: {e}")
     
     def check_geofence(self, location):
         """Check if patient is within geofence"""
-        if not self.config['geofence']['enabled']:
+        if not self._gf_enabled:
             return True
         
         try:
-            import math
-            
             lat1 = math.radians(location['latitude'])
             lon1 = math.radians(location['longitude'])
-            lat2 = math.radians(self.config['geofence']['latitude'])
-            lon2 = math.radians(self.config['geofence']['longitude'])
             
-            # Haversine formula
-            dlat = lat2 - lat1
-            dlon = lon2 - lon1
-            a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-            c = 2 * math.asin(math.sqrt(a))
-            r = 6371  # Earth's radius in km
-            distance = c * r * 1000  # Convert to meters
+            # Haversine formula against the cached center
+            dlat = self._gf_lat2 - lat1
+            dlon = self._gf_lon2 - lon1
+            a = math.sin(dlat/2)**2 + math.cos(lat1) * self._gf_cos_lat2 * math.sin(dlon/2)**2
+            distance = 2 * math.asin(math.sqrt(a)) * 6371000  # meters
             
-            if distance > self.config['geofence']['radius']:
+            if distance > self._gf_radius:
                 self.trigger_alert('GEOFENCE_BREACH', 
                                  f"Patient left safe area. Distance: {distance:.2f}m",
                                  location['latitude'], location['longitude'])
@@ -286,31 +672,38 @@ class PatientTracker:
         """Trigger alert and send notifications"""
         try:
             # Store alert in database
-            cursor = self.db_conn.cursor()
-            cursor.execute('''
-                INSERT INTO alerts 
-                (patient_id, alert_type, message, latitude, longitude, timestamp)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (self.patient_id, alert_type, message, latitude, longitude, datetime.now()))
-            self.db_conn.commit()
+            self._db_queue.put(('alert', (self.patient_id, alert_type, message,
+                                          latitude, longitude, datetime.now(timezone.utc))))
             
-            # Send SMS alerts
+            # Send SMS alerts, encoding the shared body once
+            text = f"ALERT: {message}"
+            body = text.encode('ascii', 'replace') + SMS_TERMINATOR
             for number in self.config['emergency_numbers']:
-                self.send_sms_alert(number, f"ALERT: {message}")
+                self.send_sms_alert(number, text, body=body)
             
             self.logger.warning(f"Alert triggered: {alert_type} - {message}")
             
         except Exception as e:
             self.logger.error(f"Alert triggering failed: {e}")
     
-    def send_sms_alert(self, phone_number, message):
+    def send_sms_alert(self, phone_number, message, body=None):
         """Send SMS alert via GSM module"""
         try:
-            self.send_gsm_command(f'AT+CMGS="{phone_number}"', wait_time=2)
-            self.gsm_port.write((message + '\x1A').encode())
-            time.sleep(2)
-            response = self.send_gsm_command('', wait_time=2)
-            self.logger.info(f"SMS sent to {phone_number}: {message}")
+            if body is None:
+                body = message.encode('ascii', 'replace') + SMS_TERMINATOR
+            self.gsm_port.write(b'AT+CMGS="' + phone_number.encode('ascii') + b'"\r\n')
+            prompt = self.read_gsm_response(5, terminators=SMS_PROMPT)
+            if not prompt.endswith('>'):
+                self.logger.error(f"SMS to {phone_number} not accepted: {prompt}")
+                # Leave text mode input cleanly if the prompt came late
+                self.gsm_port.write(b'\x1B')
+                return
+            self.gsm_port.write(body)
+            response = self.read_gsm_response(30)
+            if '+CMGS' in response:
+                self.logger.info(f"SMS sent to {phone_number}: {message}")
+            else:
+                self.logger.error(f"SMS sending failed for {phone_number}: {response}")
         except Exception as e:
             self.logger.error(f"SMS sending failed: {e}")
     
@@ -329,7 +722,7 @@ class PatientTracker:
                 'speed': location.get('speed')
             }
             
-            response = requests.post(
+            response = self.http.post(
                 self.config['server_url'],
                 json=data,
                 timeout=10
@@ -360,50 +753,92 @@ class PatientTracker:
                     self.check_geofence(location)
                     
                     # Upload to server
-                    self.upload_to_server(location)
+                    self.queue_upload(location)
                     
                     self.logger.info(f"Location updated: {location['latitude']:.6f}, {location['longitude']:.6f}")
                 else:
                     self.logger.warning("No GPS data available")
                 
-                # Wait for next update
-                time.sleep(self.config['update_interval'])
+                # Wait for next update (returns early on stop)
+                self._stop_event.wait(self.config['update_interval'])
                 
             except KeyboardInterrupt:
                 break
             except Exception as e:
                 self.logger.error(f"Tracking loop error: {e}")
-                time.sleep(5)
+                self._stop_event.wait(5)
+    
+    def queue_upload(self, location):
+        """Hand a location to the upload thread, dropping the oldest if full"""
+        if self.config.get('server_url'):
+            self._put_upload(location)
+    
+    def _put_upload(self, item):
+        """Enqueue without blocking the caller"""
+        while True:
+            try:
+                self._upload_queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._upload_queue.get_nowait()
+                except queue.Empty:
+                    pass
+    
+    def upload_loop(self):
+        """Upload queued locations until a None sentinel arrives"""
+        while True:
+            location = self._upload_queue.get()
+            if location is None:
+                break
+            self.upload_to_server(location)
     
     def start_tracking(self):
         """Start patient tracking"""
         if not self.is_tracking:
             self.is_tracking = True
+            self._stop_event.clear()
             self.tracking_thread = threading.Thread(target=self.tracking_loop)
             self.tracking_thread.daemon = True
             self.tracking_thread.start()
+            self.upload_thread = threading.Thread(target=self.upload_loop)
+            self.upload_thread.daemon = True
+            self.upload_thread.start()
             self.logger.info("Patient tracking started")
     
     def stop_tracking(self):
         """Stop patient tracking"""
         self.is_tracking = False
+        self._stop_event.set()
         if hasattr(self, 'tracking_thread'):
             self.tracking_thread.join()
+        if hasattr(self, 'upload_thread'):
+            self._put_upload(None)
+            self.upload_thread.join(timeout=15)
         self.logger.info("Patient tracking stopped")
     
     def cleanup(self):
         """Cleanup resources"""
         try:
             self.stop_tracking()
+            if self.gsm_poller:
+                self.gsm_poller.close()
+            self._gps_reader_stop.set()
+            if hasattr(self, 'gps_reader_thread'):
+                self.gps_reader_thread.join(timeout=2)
             if self.gps_port:
                 self.gps_port.close()
             if self.gsm_port:
                 self.gsm_port.close()
-            if self.db_conn:
-                self.db_conn.close()
+            if hasattr(self, 'db_writer_thread'):
+                self._db_queue.put(None)
+                self.db_writer_thread.join(timeout=10)
+            self.http.close()
             self.logger.info("Cleanup completed")
         except Exception as e:
             self.logger.error(f"Cleanup error: {e}")
+        finally:
+            self._log_listener.stop()
 
 def signal_handler(sig, frame):
     """Handle Ctrl+C gracefully"""
@@ -5,16 +5,193 @@ GPS + GSM + Geofence + Database + SMS Alerts
 Author: Patient Tracking System
 """
 
+import os
+import abc
+import json
 import serial
+import socket
+import struct
 import time
 import sqlite3
 import threading
+import queue
 import math
-from datetime import datetime
-import pynmea2
+import functools
+import operator
+from datetime import datetime, timezone
 from signal import signal, SIGINT
+import sys
 from sys import exit
 
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; batch checks fall back to math
+    np = None
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; batch checks use plain NumPy
+    njit = None
+
+try:
+    import apsw
+    import apsw.ext
+except ImportError:  # apsw is optional; the stdlib sqlite3 driver is used
+    apsw = None
+
+# Statement text is kept constant so sqlite3's statement cache reuses the compiled form
+INSERT_LOCATION_SQL = '''
+    INSERT INTO locations 
+    (patient_id, latitude, longitude, altitude, speed, timestamp, satellites, accuracy)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+INSERT_ALERT_SQL = '''
+    INSERT INTO alerts 
+    (patient_id, alert_type, message, latitude, longitude, timestamp, sms_sent)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+INSERT_STATUS_SQL = '''
+    INSERT INTO system_status (component, status, message, timestamp)
+    VALUES (?, ?, ?, ?)
+'''
+
+# u-blox modules power up at 9600 baud until told otherwise with PUBX,41
+GPS_FACTORY_BAUDRATE = 9600
+
+# Only these sentences carry a fix; anything else is dropped before decoding
+NMEA_FIX_PREFIXES = (b'$GPGGA', b'$GPRMC')
+
+# Status events go to an append-only text log; system_status gets a periodic summary
+STATUS_LOG_PATH = 'status.log'
+STATUS_LOG_MAX_BYTES = 1 << 20  # rotated to status.log.1 past this size
+STATUS_SUMMARY_INTERVAL = 3600  # seconds
+
+# Binary uplink record: type code, lat, lon, epoch seconds, geofence radius (25 bytes)
+ALERT_STRUCT = struct.Struct('<BddIf')
+ALERT_TYPE_CODES = {'GEOFENCE_BREACH': 1, 'GPS_LOST': 2}
+
+if njit is not None and np is not None:
+    @njit(cache=True, fastmath=True)
+    def _haversine_np(lat, lon, gflat, gflon, coslat):
+        """Haversine distances in meters from the geofence center (radians) for degree arrays"""
+        out = np.empty(lat.shape[0])
+        for i in range(lat.shape[0]):
+            lat1 = math.radians(lat[i])
+            sdlat = math.sin((lat1 - gflat) * 0.5)
+            sdlon = math.sin((math.radians(lon[i]) - gflon) * 0.5)
+            a = sdlat * sdlat + math.cos(lat1) * coslat * sdlon * sdlon
+            out[i] = 12742000.0 * math.asin(math.sqrt(a))
+        return out
+else:
+    def _haversine_np(lat, lon, gflat, gflon, coslat):
+        """Haversine distances in meters from the geofence center (radians) for degree arrays"""
+        lat1 = np.deg2rad(lat)
+        dlat = lat1 - gflat
+        dlon = np.deg2rad(lon) - gflon
+        a = np.sin(dlat * 0.5)**2 + np.cos(lat1) * coslat * np.sin(dlon * 0.5)**2
+        return 12742000.0 * np.arcsin(np.sqrt(a))
+
+def adapt_utc(value):
+    """Store datetimes as fixed-width UTC text, so string order is time order"""
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%fZ')
+
+sqlite3.register_adapter(datetime, adapt_utc)
+
+def connect_database(path):
+    """Open the tracking database with apsw when installed, else sqlite3"""
+    if apsw is None:
+        return sqlite3.connect(path, check_same_thread=False, cached_statements=256)
+    
+    conn = apsw.Connection(path, statementcachesize=256)
+    conn.setbusytimeout(5000)
+    # Store datetimes as the same UTC text the sqlite3 adapter writes
+    factory = apsw.ext.TypesConverterCursorFactory()
+    factory.register_adapter(datetime, adapt_utc)
+    conn.cursor_factory = factory
+    return conn
+
+def pubx_set_baudrate(baudrate):
+    """Build the u-blox PUBX,41 sentence that moves UART1 to baudrate (UBX+NMEA+RTCM in, UBX+NMEA out)"""
+    body = f'PUBX,41,1,0007,0003,{baudrate},0'
+    checksum = functools.reduce(operator.xor, body.encode('ascii'), 0)
+    return f'${body}*{checksum:02X}\r\n'.encode('ascii')
+
+def nmea_to_degrees(value, hemisphere):
+    """Convert an NMEA (d)ddmm.mmmm field to signed decimal degrees"""
+    if not value:
+        return None
+    dot = value.find('.')
+    if dot < 0:
+        dot = len(value)
+    degrees = int(value[:dot - 2]) + float(value[dot - 2:]) / 60.0
+    return -degrees if hemisphere in ('S', 'W') else degrees
+
+def nmea_checksum_valid(line):
+    """Check the *XX checksum when the sentence carries one"""
+    star = line.find('*')
+    if star < 0:
+        return True
+    try:
+        expected = int(line[star + 1:star + 3], 16)
+    except ValueError:
+        return False
+    return functools.reduce(operator.xor, line[1:star].encode('ascii', 'ignore'), 0) == expected
+
+class AlertTransport(abc.ABC):
+    """Delivers alerts; send() returns {recipient: delivered}"""
+    def available(self):
+        return True
+    
+    @abc.abstractmethod
+    def send(self, alert):
+        """Deliver one alert dict; returns {recipient: delivered}"""
+
+class SMSTransport(AlertTransport):
+    """Text alerts to the tracker's emergency contacts over the GSM modem"""
+    def __init__(self, tracker):
+        self.tracker = tracker
+    
+    def available(self):
+        return self.tracker.gsm_serial is not None
+    
+    def send(self, alert):
+        return self.tracker.send_sms_alert(self.tracker.emergency_contacts,
+                                           f"ALERT: {alert['message']}")
+
+class SocketTransport(AlertTransport):
+    """Packed ALERT_STRUCT records over TCP, for modems with an IP data link"""
+    def __init__(self, host, port, timeout=5):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+    
+    def send(self, alert):
+        record = ALERT_STRUCT.pack(
+            ALERT_TYPE_CODES.get(alert['alert_type'], 0),
+            alert['latitude'],
+            alert['longitude'],
+            int(alert['timestamp'].timestamp()),
+            alert['radius']
+        )
+        try:
+            with socket.create_connection((self.host, self.port), self.timeout) as sock:
+                sock.sendall(record)
+            sent = True
+        except OSError:
+            sent = False
+        return {f"{self.host}:{self.port}": sent}
+
+def load_uplink(path='config.json'):
+    """(host, port) from config.json's "uplink" entry, or None to alert by SMS"""
+    try:
+        with open(path, 'r') as f:
+            uplink = json.load(f).get('uplink')
+        if not isinstance(uplink, dict) or not uplink.get('host'):
+            return None
+        return str(uplink['host']), int(uplink['port'])
+    except (OSError, KeyError, TypeError, ValueError, AttributeError):
+        return None  # missing or malformed entry; alerts go by SMS
+
 class PatientTracker:
     def __init__(self):
         print("=" * 60)
@@ -22,15 +199,22 @@ class PatientTracker:
         print("Raspberry Pi Zero WH")
         print("=" * 60)
         
+        # Console output from the tracking path goes through a bounded queue
+        self._log_q = queue.Queue(maxsize=256)
+        self.log_thread = threading.Thread(target=self.log_writer_loop)
+        self.log_thread.daemon = True
+        self.log_thread.start()
+        
         # Patient Configuration
         self.patient_id = "PATIENT001"
         self.emergency_contacts = ["+918848776875", "+9175929912412"]
         
         # Hardware Configuration
-        self.gps_port = "/dev/ttyS0"
-        self.gps_baudrate = 9600
+        self.gps_port = "/dev/ttyAMA0"  # PL011; needs dtoverlay=disable-bt
+        self.gps_baudrate = 38400
         self.gsm_port = "/dev/ttyUSB0"
         self.gsm_baudrate = 115200
+        self.uplink = load_uplink()  # (host, port) to send binary alerts over TCP instead of SMS
         
         # Tracking Configuration
         self.update_interval = 10  # seconds
@@ -38,21 +222,64 @@ class PatientTracker:
         self.geofence_lat = 40.7128  # Default: NYC
         self.geofence_lon = -74.0060
         self.geofence_radius = 100  # meters
+        self.gps_lost_timeout = 60  # seconds without a fix before GPS_LOST
+        
+        # The geofence center is fixed, so its trig terms are computed once
+        self._gf_lat_rad = math.radians(self.geofence_lat)
+        self._gf_lon_rad = math.radians(self.geofence_lon)
+        self._cos_gf_lat = math.cos(self._gf_lat_rad)
         
         # System State
         self.gps_serial = None
         self.gsm_serial = None
+        self._gps_rx = bytearray()  # raw UART bytes not yet split into lines
+        self._gps_rx_lock = threading.Lock()
+        self._gps_reader_stop = threading.Event()
         self.db_conn = None
+        self._loc_buffer = []
+        self._loc_flush_every = 6  # one commit per minute at 10 s updates
         self.is_tracking = False
         self.current_location = None
+        self._pending_fix = None  # newest fix parsed since the last tick
+        self._last_fix_monotonic = time.monotonic()
+        self._gps_lost_alerted = False
+        self._status_log = open(STATUS_LOG_PATH, 'ab', buffering=0)
+        self._status_lock = threading.Lock()
+        self._status_counts = {}  # (component, status) -> (count, last message)
+        self._status_summary_due = time.monotonic() + STATUS_SUMMARY_INTERVAL
         
         # Initialize System
         self.initialize_database()
         self.initialize_hardware()
+        self.transport = SocketTransport(*self.uplink) if self.uplink else SMSTransport(self)
         
         # Display Configuration
         self.display_configuration()
         
+    def log(self, line):
+        """Queue a console line without blocking; dropped if the queue is full"""
+        try:
+            self._log_q.put_nowait(line + '\n')
+        except queue.Full:
+            pass
+    
+    def log_writer_loop(self):
+        """Drain queued console lines to stdout, one write per batch"""
+        while True:
+            lines = [self._log_q.get()]
+            try:
+                while True:
+                    lines.append(self._log_q.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                sys.stdout.write(''.join(lines))
+                sys.stdout.flush()
+            except Exception:
+                pass
+            for _ in lines:
+                self._log_q.task_done()
+    
     def display_configuration(self):
         """Display current configuration"""
         print(f"\n📋 CONFIGURATION:")
@@ -70,9 +297,20 @@ class PatientTracker:
         """Initialize SQLite database"""
         try:
             print("\n🗄️  Initializing database...")
-            self.db_conn = sqlite3.connect('patient_tracking.db', check_same_thread=False)
+            self.db_conn = connect_database('patient_tracking.db')
             cursor = self.db_conn.cursor()
             
+            # WAL keeps each commit to one append on the SD card
+            journal_mode = cursor.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+            if journal_mode.lower() != 'wal':
+                print(f"⚠️  WAL mode unavailable, using {journal_mode} journal")
+            for pragma in ('synchronous=NORMAL', 'temp_store=MEMORY', 'cache_size=-4000',
+                           'busy_timeout=5000', 'mmap_size=67108864'):
+                cursor.execute(f'PRAGMA {pragma}')
+            
+            # Create all tables in one transaction
+            cursor.execute('BEGIN')
+            
             # Locations table
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS locations (
@@ -114,7 +352,24 @@ class PatientTracker:
                 )
             ''')
             
-            self.db_conn.commit()
+            # Indexes for per-patient time-range queries; open alerts get a partial index
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_locations_patient_ts
+                ON locations(patient_id, timestamp)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_alerts_patient_ts
+                ON alerts(patient_id, timestamp)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_alerts_unresolved
+                ON alerts(patient_id, timestamp) WHERE resolved = 0
+            ''')
+            
+            cursor.execute('COMMIT')
+            
+            # Reused by every insert instead of a fresh cursor per call
+            self._cur = cursor
             print("✅ Database initialized successfully")
             
         except Exception as e:
@@ -126,12 +381,14 @@ class PatientTracker:
         try:
             # Initialize GPS
             print(f"\n🛰️  Initializing GPS module...")
-            self.gps_serial = serial.Serial(
-                self.gps_port,
-                self.gps_baudrate,
-                timeout=2
-            )
-            print(f"✅ GPS connected on {self.gps_port}")
+            self.gps_serial = self.open_gps_port()
+            print(f"✅ GPS connected on {self.gps_port} @ {self.gps_serial.baudrate} baud")
+            
+            # Drain the UART every second so the driver buffer never
+            # overflows between 10 s updates
+            self.gps_reader_thread = threading.Thread(target=self.gps_reader_loop)
+            self.gps_reader_thread.daemon = True
+            self.gps_reader_thread.start()
             
             # Initialize GSM (optional)
             print(f"\n📱 Initializing GSM module...")
@@ -167,6 +424,37 @@ class PatientTracker:
             print("   Or run with: sudo python3 patient_tracker.py")
             raise
     
+    def open_gps_port(self):
+        """Open the GPS UART, moving a factory-rate u-blox module up to gps_baudrate"""
+        port = serial.Serial(self.gps_port, self.gps_baudrate, timeout=2)
+        if self.gps_baudrate == GPS_FACTORY_BAUDRATE or self._gps_talking(port):
+            return port
+        
+        # Silent at the configured rate: look for the module at its power-up rate
+        port.baudrate = GPS_FACTORY_BAUDRATE
+        if not self._gps_talking(port):
+            port.baudrate = self.gps_baudrate
+            return port  # nothing heard yet; keep the configured rate
+        
+        print(f"   Switching GPS from {GPS_FACTORY_BAUDRATE} to {self.gps_baudrate} baud...")
+        port.write(pubx_set_baudrate(self.gps_baudrate))
+        port.flush()
+        time.sleep(0.1)
+        port.baudrate = self.gps_baudrate
+        port.reset_input_buffer()
+        if not self._gps_talking(port):
+            print(f"⚠️  GPS ignored PUBX,41; staying at {GPS_FACTORY_BAUDRATE} baud")
+            port.baudrate = GPS_FACTORY_BAUDRATE
+        return port
+    
+    def _gps_talking(self, port, seconds=2):
+        """True if an NMEA sentence arrives on port within seconds"""
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            if b'$G' in port.read_until(b'\n', 256):
+                return True
+        return False
+    
     def test_gsm_module(self):
         """Test GSM module functionality"""
         if not self.gsm_serial:
@@ -207,287 +495,416 @@ class PatientTracker:
             
         try:
             self.gsm_serial.write((command + '\r\n').encode())
-            time.sleep(wait_time)
-            response = ''
-            while self.gsm_serial.in_waiting > 0:
-                response += self.gsm_serial.read(self.gsm_serial.in_waiting).decode()
-            return response.strip()
+            # Returns as soon as the modem answers OK, or after the port timeout
+            response = self.gsm_serial.read_until(b'OK\r\n', 4096)
+            if b'OK' not in response and self.gsm_serial.in_waiting > 0:
+                response += self.gsm_serial.read(self.gsm_serial.in_waiting)
+            return response.decode(errors='ignore').strip()
         except Exception as e:
             return ""
     
-    def parse_gps_data(self, raw_data):
-        """Parse NMEA GPS data"""
-        try:
-            for line in raw_data.split('\n'):
-                line = line.strip()
-                if not line or not line.startswith('$'):
-                    continue
-                    
-                try:
-                    if line.startswith('$GPGGA'):
-                        msg = pynmea2.parse(line)
-                        return {
-                            'latitude': msg.latitude,
-                            'longitude': msg.longitude,
-                            'altitude': msg.altitude,
-                            'timestamp': datetime.now(),
-                            'satellites': msg.num_sats,
-                            'fix_quality': msg.gps_qual,
-                            'hdop': getattr(msg, 'hdop', None)
-                        }
-                    elif line.startswith('$GPRMC'):
-                        msg = pynmea2.parse(line)
-                        return {
-                            'latitude': msg.latitude,
-                            'longitude': msg.longitude,
-                            'speed': msg.spd_over_grnd * 1.852 if msg.spd_over_grnd else 0,  # Convert knots to km/h
-                            'timestamp': datetime.now(),
-                            'fix_valid': msg.is_valid
-                        }
-                except pynmea2.ParseError:
-                    continue
-                    
-        except Exception as e:
-            print(f"   GPS parsing error: {e}")
+    def _parse_gpgga(self, fields, now):
+        """Build a location from the fields of a $GPGGA sentence"""
+        latitude = nmea_to_degrees(fields[2], fields[3])
+        longitude = nmea_to_degrees(fields[4], fields[5])
+        if latitude is None or longitude is None:
+            return None
+        return {
+            'latitude': latitude,
+            'longitude': longitude,
+            'altitude': float(fields[9]) if fields[9] else None,
+            'timestamp': now,
+            'satellites': int(fields[7]) if fields[7] else None,
+            'fix_quality': int(fields[6]) if fields[6] else 0,
+            'hdop': float(fields[8]) if fields[8] else None
+        }
+    
+    def _parse_gprmc(self, fields, now):
+        """Build a location from the fields of a $GPRMC sentence"""
+        latitude = nmea_to_degrees(fields[3], fields[4])
+        longitude = nmea_to_degrees(fields[5], fields[6])
+        if latitude is None or longitude is None:
+            return None
+        return {
+            'latitude': latitude,
+            'longitude': longitude,
+            'speed': float(fields[7]) * 1.852 if fields[7] else 0,  # Convert knots to km/h
+            'timestamp': now,
+            'fix_valid': fields[2] == 'A'
+        }
+    
+    def parse_nmea_line(self, line, now):
+        """Parse one NMEA sentence, returning a location for GGA/RMC fixes"""
+        line = line.strip()
+        if not line.startswith('$GP'):
+            return None
+        kind = line[3:6]
+        if kind not in ('GGA', 'RMC') or not nmea_checksum_valid(line):
+            return None
         
+        fields = line.split('*', 1)[0].split(',')
+        try:
+            if kind == 'GGA' and len(fields) >= 10:
+                return self._parse_gpgga(fields, now)
+            elif kind == 'RMC' and len(fields) >= 8:
+                return self._parse_gprmc(fields, now)
+        except ValueError:
+            pass
         return None
     
-    def get_gps_location(self):
+    def gps_reader_loop(self):
+        """Move GPS bytes from the UART into the receive buffer"""
+        while not self._gps_reader_stop.is_set():
+            try:
+                data = self.gps_serial.read(self.gps_serial.in_waiting or 1)
+            except Exception:
+                if self._gps_reader_stop.wait(1):
+                    break
+                continue
+            if data:
+                with self._gps_rx_lock:
+                    self._gps_rx.extend(data)
+                    # Keep only the newest 4 KB if nobody is consuming
+                    if len(self._gps_rx) > 4096:
+                        del self._gps_rx[:-4096]
+            self._gps_reader_stop.wait(1)
+    
+    def _pump_gps(self, now=None):
+        """Parse buffered GPS lines into the pending fix"""
+        if now is None:
+            now = datetime.now(timezone.utc)
+        location = self._pending_fix
+        with self._gps_rx_lock:
+            rx = self._gps_rx
+            # Pop complete lines; a partial sentence waits for its end
+            while True:
+                end = rx.find(b'\n')
+                if end < 0:
+                    break
+                line = bytes(rx[:end])
+                del rx[:end + 1]
+                if not line.startswith(NMEA_FIX_PREFIXES):
+                    continue  # GSV/GSA chatter or cold-boot noise
+                parsed = self.parse_nmea_line(line.decode('ascii', 'ignore'), now)
+                if parsed:
+                    # Newer sentences win; GGA and RMC fill in each other's fields
+                    location = {**location, **parsed} if location else parsed
+        self._pending_fix = location
+    
+    def get_gps_location(self, now=None):
         """Get current GPS location"""
         try:
-            if self.gps_serial and self.gps_serial.in_waiting > 0:
-                raw_data = self.gps_serial.read(self.gps_serial.in_waiting).decode('ascii', errors='ignore')
-                location = self.parse_gps_data(raw_data)
-                if location:
-                    self.current_location = location
-                    return location
+            self._pump_gps(now)
+            location, self._pending_fix = self._pending_fix, None
+            if location:
+                self.current_location = location
+                self._last_fix_monotonic = time.monotonic()
+                return location
         except Exception as e:
-            print(f"   GPS reading error: {e}")
+            self.log(f"   GPS reading error: {e}")
         
         return None
     
     def store_location(self, location):
-        """Store location data in database"""
-        try:
-            cursor = self.db_conn.cursor()
-            cursor.execute('''
-                INSERT INTO locations 
-                (patient_id, latitude, longitude, altitude, speed, timestamp, satellites, accuracy)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                self.patient_id,
-                location.get('latitude'),
-                location.get('longitude'),
-                location.get('altitude'),
-                location.get('speed'),
-                location.get('timestamp'),
-                location.get('satellites'),
-                location.get('hdop')
-            ))
-            self.db_conn.commit()
-            
-        except Exception as e:
-            print(f"   Database storage error: {e}")
+        """Buffer location data, writing it to the database in batches"""
+        self._loc_buffer.append((
+            self.patient_id,
+            location.get('latitude'),
+            location.get('longitude'),
+            location.get('altitude'),
+            location.get('speed'),
+            location.get('timestamp'),
+            location.get('satellites'),
+            location.get('hdop')
+        ))
+        if len(self._loc_buffer) >= self._loc_flush_every:
+            self.flush_locations()
     
-    def calculate_distance(self, lat1, lon1, lat2, lon2):
-        """Calculate distance between two coordinates using Haversine formula"""
+    def flush_locations(self):
+        """Write buffered locations in a single transaction"""
+        if not self._loc_buffer:
+            return
         try:
-            # Convert to radians
-            lat1_rad = math.radians(lat1)
-            lon1_rad = math.radians(lon1)
-            lat2_rad = math.radians(lat2)
-            lon2_rad = math.radians(lon2)
-            
-            # Haversine formula
-            dlat = lat2_rad - lat1_rad
-            dlon = lon2_rad - lon1_rad
-            a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
-            c = 2 * math.asin(math.sqrt(a))
-            
-            # Earth's radius in meters
-            distance = c * 6371000
-            return distance
+            with self.db_conn:
+                self._cur.executemany(INSERT_LOCATION_SQL, self._loc_buffer)
+            self._loc_buffer.clear()
             
         except Exception as e:
-            print(f"   Distance calculation error: {e}")
-            return float('inf')
+            self.log(f"   Database storage error: {e}")
     
-    def check_geofence(self, location):
+    def _distance_to_geofence(self, lat, lon):
+        """Haversine distance in meters from the geofence center"""
+        lat1 = math.radians(lat)
+        dlat = lat1 - self._gf_lat_rad
+        dlon = math.radians(lon) - self._gf_lon_rad
+        a = math.sin(dlat * 0.5)**2 + math.cos(lat1) * self._cos_gf_lat * math.sin(dlon * 0.5)**2
+        return 12742000.0 * math.asin(math.sqrt(a))  # Earth's diameter in meters
+    
+    def check_geofence_batch(self, lats, lons):
+        """Return a breach mask for many fixes at once (NumPy array, or list without NumPy)"""
+        if np is None:
+            return [self._distance_to_geofence(lat, lon) > self.geofence_radius
+                    for lat, lon in zip(lats, lons)]
+        
+        distance = _haversine_np(np.asarray(lats, dtype=np.float64),
+                                 np.asarray(lons, dtype=np.float64),
+                                 self._gf_lat_rad, self._gf_lon_rad, self._cos_gf_lat)
+        return distance > self.geofence_radius
+    
+    def locations_source(self):
+        """Table to read fixes from: patient_tracker.py's locations_view when it
+        exists (its rows only fill the fixed-point columns), else the table"""
+        row = self.db_conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = 'locations_view'"
+        ).fetchone()
+        return 'locations' if row is None else 'locations_view'
+    
+    def replay_day(self, day):
+        """Recompute geofence breaches for every stored fix on day (YYYY-MM-DD, UTC)"""
+        self.flush_locations()
+        rows = self.db_conn.execute(f'''
+            SELECT latitude, longitude FROM {self.locations_source()}
+            WHERE patient_id = ? AND timestamp BETWEEN ? AND ?
+            ORDER BY timestamp
+        ''', (self.patient_id, f"{day} 00:00:00", f"{day} 23:59:59.999999Z")).fetchall()
+        if not rows:
+            return []
+        lats, lons = zip(*rows)
+        return self.check_geofence_batch(lats, lons)
+    
+    def check_geofence(self, location, distance=None, now=None):
         """Check if patient is within geofence"""
         if not self.geofence_enabled:
             return True
         
         try:
-            distance = self.calculate_distance(
-                location['latitude'],
-                location['longitude'],
-                self.geofence_lat,
-                self.geofence_lon
-            )
+            if distance is None:
+                distance = self._distance_to_geofence(location['latitude'], location['longitude'])
             
             if distance > self.geofence_radius:
                 self.trigger_alert(
                     'GEOFENCE_BREACH',
                     f"Patient left safe area. Distance: {distance:.1f}m from center",
                     location['latitude'],
-                    location['longitude']
+                    location['longitude'],
+                    now
                 )
                 return False
             else:
                 return True
                 
         except Exception as e:
-            print(f"   Geofence check error: {e}")
+            self.log(f"   Geofence check error: {e}")
             return True
     
-    def trigger_alert(self, alert_type, message, latitude, longitude):
+    def trigger_alert(self, alert_type, message, latitude, longitude, now=None):
         """Trigger alert and send notifications"""
         try:
-            print(f"\n🚨 ALERT: {alert_type}")
-            print(f"   📝 Message: {message}")
-            print(f"   📍 Location: {latitude:.6f}, {longitude:.6f}")
-            print(f"   ⏰ Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+            alert_time = now if now is not None else datetime.now(timezone.utc)
+            self.log(f"\n🚨 ALERT: {alert_type}")
+            self.log(f"   📝 Message: {message}")
+            self.log(f"   📍 Location: {latitude:.6f}, {longitude:.6f}")
+            self.log(f"   ⏰ Time: {alert_time.astimezone().strftime('%Y-%m-%d %H:%M:%S')}")
             
-            # Store alert in database
-            cursor = self.db_conn.cursor()
-            cursor.execute('''
-                INSERT INTO alerts 
-                (patient_id, alert_type, message, latitude, longitude, timestamp)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (self.patient_id, alert_type, message, latitude, longitude, datetime.now()))
-            self.db_conn.commit()
+            # Persist the fixes leading up to the alert first
+            self.flush_locations()
             
-            # Send SMS alerts
+            # Send alert notifications
             sms_sent_count = 0
-            if self.gsm_serial:
-                for number in self.emergency_contacts:
-                    print(f"   📱 Sending SMS to {number}...")
-                    if self.send_sms_alert(number, f"ALERT: {message}"):
+            if self.transport.available():
+                self.log(f"   📱 Sending alert via {type(self.transport).__name__}...")
+                results = self.transport.send({
+                    'alert_type': alert_type,
+                    'message': message,
+                    'latitude': latitude,
+                    'longitude': longitude,
+                    'timestamp': alert_time,
+                    'radius': self.geofence_radius
+                })
+                for recipient, sent in results.items():
+                    if sent:
                         sms_sent_count += 1
-                        print(f"   ✅ SMS sent to {number}")
+                        self.log(f"   ✅ Alert sent to {recipient}")
                     else:
-                        print(f"   ❌ SMS failed to {number}")
+                        self.log(f"   ❌ Alert failed to {recipient}")
             else:
-                print("   ⚠️  GSM not available - SMS alerts disabled")
+                self.log("   ⚠️  GSM not available - SMS alerts disabled")
             
-            # Update alert record
-            cursor.execute('''
-                UPDATE alerts SET sms_sent = ? WHERE id = last_insert_rowid()
-            ''', (sms_sent_count > 0,))
-            self.db_conn.commit()
+            # Store alert in database once the SMS outcome is known
+            with self.db_conn:
+                self._cur.execute(INSERT_ALERT_SQL, (
+                    self.patient_id, alert_type, message, latitude, longitude, alert_time,
+                    sms_sent_count > 0
+                ))
             
-            self.log_system_status("ALERT", alert_type, message)
+            self.log_system_status("ALERT", alert_type, message, alert_time)
             
         except Exception as e:
-            print(f"   Alert triggering failed: {e}")
+            self.log(f"   Alert triggering failed: {e}")
     
-    def send_sms_alert(self, phone_number, message):
-        """Send SMS alert via GSM module"""
+    def send_sms_alert(self, phone_numbers, message):
+        """Send SMS alert via GSM module; returns {number: sent}"""
+        if isinstance(phone_numbers, str):
+            phone_numbers = [phone_numbers]
+        results = dict.fromkeys(phone_numbers, False)
         if not self.gsm_serial:
-            return False
+            return results
             
         try:
-            # Send SMS command
-            self.gsm_serial.write(f'AT+CMGS="{phone_number}"\r\n'.encode())
-            time.sleep(1)
-            
-            # Send message content
-            self.gsm_serial.write(f'{message}\x1A'.encode())
-            time.sleep(2)
-            
-            # Check response
-            response = ''
-            while self.gsm_serial.in_waiting > 0:
-                response += self.gsm_serial.read(self.gsm_serial.in_waiting).decode()
+            # Text mode once, then the recipients back to back
+            self.send_gsm_command('AT+CMGF=1')
+            body = f'{message}\x1A'.encode()
             
-            return '+CMGS:' in response
+            for number in phone_numbers:
+                # Send SMS command and wait for the text prompt
+                self.gsm_serial.write(f'AT+CMGS="{number}"\r\n'.encode())
+                if not self.gsm_serial.read_until(b'>', 256).endswith(b'>'):
+                    continue
+                
+                # Send message content
+                self.gsm_serial.write(body)
+                
+                # Check response; network delivery can outlast one port timeout
+                response = b''
+                for _ in range(15):
+                    response += self.gsm_serial.read_until(b'OK\r\n', 4096)
+                    if b'OK' in response or b'ERROR' in response:
+                        break
+                
+                results[number] = b'+CMGS:' in response
             
         except Exception as e:
-            print(f"   SMS sending error: {e}")
-            return False
+            self.log(f"   SMS sending error: {e}")
+        
+        return results
     
-    def log_system_status(self, component, status, message):
-        """Log system status to database"""
+    def log_system_status(self, component, status, message, now=None):
+        """Log system status to status.log; the database gets a periodic summary"""
         try:
-            cursor = self.db_conn.cursor()
-            cursor.execute('''
-                INSERT INTO system_status (component, status, message, timestamp)
-                VALUES (?, ?, ?, ?)
-            ''', (component, status, message, datetime.now()))
-            self.db_conn.commit()
+            if now is None:
+                now = datetime.now(timezone.utc)
+            line = f"{now}\t{component}\t{status}\t{message}\n".encode()
+            with self._status_lock:
+                self._status_log.write(line)
+                if self._status_log.tell() > STATUS_LOG_MAX_BYTES:
+                    self._status_log.close()
+                    os.replace(STATUS_LOG_PATH, STATUS_LOG_PATH + '.1')
+                    self._status_log = open(STATUS_LOG_PATH, 'ab', buffering=0)
+                count, _ = self._status_counts.get((component, status), (0, None))
+                self._status_counts[(component, status)] = (count + 1, message)
+            if time.monotonic() >= self._status_summary_due:
+                self.summarize_system_status()
+        except Exception as e:
+            pass  # Silent fail for logging
+    
+    def summarize_system_status(self):
+        """Write one system_status row per component/status seen since the last summary"""
+        with self._status_lock:
+            counts, self._status_counts = self._status_counts, {}
+            self._status_summary_due = time.monotonic() + STATUS_SUMMARY_INTERVAL
+        if not counts:
+            return
+        try:
+            with self.db_conn:
+                for (component, status), (count, message) in counts.items():
+                    if count > 1:
+                        message = f"{message} ({count} events)"
+                    self._insert_system_status(component, status, message)
         except Exception as e:
             pass  # Silent fail for logging
     
+    def _insert_system_status(self, component, status, message):
+        """Insert a status row; the caller owns the transaction"""
+        self._cur.execute(INSERT_STATUS_SQL, (component, status, message, datetime.now(timezone.utc)))
+    
     def tracking_loop(self):
         """Main tracking loop"""
-        print(f"\n🚀 Starting patient tracking...")
-        print(f"   Update interval: {self.update_interval} seconds")
-        print(f"   Press Ctrl+C to stop")
-        print("-" * 60)
+        self.log(f"\n🚀 Starting patient tracking...")
+        self.log(f"   Update interval: {self.update_interval} seconds")
+        self.log(f"   Press Ctrl+C to stop")
+        self.log("-" * 60)
         
         update_count = 0
         consecutive_failures = 0
+        next_update = time.monotonic()
+        self._last_fix_monotonic = next_update
         
         while self.is_tracking:
             try:
                 update_count += 1
-                print(f"\n[{datetime.now().strftime('%H:%M:%S')}] Update #{update_count}")
+                now = datetime.now(timezone.utc)  # one timestamp for everything this tick records
+                self.log(f"\n[{now.astimezone().strftime('%H:%M:%S')}] Update #{update_count}")
                 
                 # Get GPS location
-                location = self.get_gps_location()
+                location = self.get_gps_location(now)
                 
                 if location:
                     consecutive_failures = 0
+                    self._gps_lost_alerted = False
                     
                     # Display location info
-                    print(f"   📍 Location: {location['latitude']:.6f}, {location['longitude']:.6f}")
+                    self.log(f"   📍 Location: {location['latitude']:.6f}, {location['longitude']:.6f}")
                     if location.get('altitude'):
-                        print(f"   🏔️  Altitude: {location['altitude']:.1f}m")
+                        self.log(f"   🏔️  Altitude: {location['altitude']:.1f}m")
                     if location.get('speed'):
-                        print(f"   🚗 Speed: {location['speed']:.1f} km/h")
+                        self.log(f"   🚗 Speed: {location['speed']:.1f} km/h")
                     if location.get('satellites'):
-                        print(f"   🛰️  Satellites: {location['satellites']}")
+                        self.log(f"   🛰️  Satellites: {location['satellites']}")
                     if location.get('fix_quality'):
                         fix_status = "Good" if location['fix_quality'] >= 1 else "Poor"
-                        print(f"   📡 GPS Fix: {fix_status}")
+                        self.log(f"   📡 GPS Fix: {fix_status}")
                     
                     # Store location
                     self.store_location(location)
-                    print("   💾 Location saved to database")
+                    self.log("   💾 Location saved to database")
                     
                     # Check geofence
                     if self.geofence_enabled:
-                        geofence_status = self.check_geofence(location)
+                        distance = self._distance_to_geofence(location['latitude'], location['longitude'])
+                        geofence_status = self.check_geofence(location, distance, now)
                         if geofence_status:
-                            distance = self.calculate_distance(
-                                location['latitude'], location['longitude'],
-                                self.geofence_lat, self.geofence_lon
-                            )
-                            print(f"   ✅ Within safe area ({distance:.0f}m from center)")
+                            self.log(f"   ✅ Within safe area ({distance:.0f}m from center)")
                     
                 else:
                     consecutive_failures += 1
-                    print(f"   ⚠️  No GPS data available")
-                    print(f"   📡 Waiting for satellite lock... (attempt {consecutive_failures})")
+                    self.log(f"   ⚠️  No GPS data available")
+                    self.log(f"   📡 Waiting for satellite lock... (attempt {consecutive_failures})")
                     
-                    if consecutive_failures >= 6:  # 1 minute of failures
-                        print(f"   🚨 GPS signal lost for {consecutive_failures * self.update_interval} seconds")
+                    # Real time since the last fix, so stalls are counted too
+                    elapsed = time.monotonic() - self._last_fix_monotonic
+                    if elapsed > self.gps_lost_timeout and not self._gps_lost_alerted:
+                        self._gps_lost_alerted = True
+                        self.log(f"   🚨 GPS signal lost for {elapsed:.0f} seconds")
                         self.trigger_alert(
                             'GPS_LOST',
-                            f"GPS signal lost for {consecutive_failures * self.update_interval} seconds",
+                            f"GPS signal lost for {elapsed:.0f} seconds",
                             self.current_location['latitude'] if self.current_location else 0,
-                            self.current_location['longitude'] if self.current_location else 0
+                            self.current_location['longitude'] if self.current_location else 0,
+                            now
                         )
                 
-                # Wait for next update
-                print(f"   ⏳ Next update in {self.update_interval} seconds...")
-                time.sleep(self.update_interval)
+                self.log(f"   ⏳ Next update in {self.update_interval} seconds...")
+                
+                if time.monotonic() >= self._status_summary_due:
+                    self.summarize_system_status()
                 
             except KeyboardInterrupt:
                 break
             except Exception as e:
-                print(f"   ❌ Tracking error: {e}")
-                time.sleep(5)
+                self.log(f"   ❌ Tracking error: {e}")
+            
+            # Keep parsing GPS input until the next tick on a fixed schedule
+            next_update += self.update_interval
+            clock = time.monotonic()
+            if next_update < clock:
+                next_update = clock  # fell behind; don't burst to catch up
+            while self.is_tracking and clock < next_update:
+                try:
+                    self._pump_gps()
+                except Exception as e:
+                    self.log(f"   GPS reading error: {e}")
+                time.sleep(min(0.1, next_update - clock))
+                clock = time.monotonic()
     
     def start_tracking(self):
         """Start patient tracking"""
@@ -508,9 +925,15 @@ class PatientTracker:
     def cleanup(self):
         """Cleanup resources"""
         try:
+            self.stop_tracking()
+            
+            # Let queued tracking output reach the console first
+            self._log_q.join()
             print("\n🧹 Shutting down system...")
             
-            self.stop_tracking()
+            self._gps_reader_stop.set()
+            if hasattr(self, 'gps_reader_thread'):
+                self.gps_reader_thread.join(timeout=3)
             
             if self.gps_serial:
                 self.gps_serial.close()
@@ -521,8 +944,11 @@ class PatientTracker:
                 print("✅ GSM port closed")
             
             if self.db_conn:
+                self.flush_locations()
+                self.summarize_system_status()
                 self.db_conn.close()
                 print("✅ Database closed")
+            self._status_log.close()
             
             print("✅ System shutdown complete")
             
@@ -6,56 +6,227 @@ Automatically handles serial port permissions on Raspberry Pi
 
 import os
 import sys
+import grp
+import pwd
 import subprocess
 import serial
 import time
-import json
 import sqlite3
 import threading
-import logging
-from datetime import datetime
-import pynmea2
-import requests
-from signal import signal, SIGINT
-from sys import exit
+import queue
+import selectors
+import socket
+import functools
+import operator
+import math
+import re
+from datetime import datetime, timezone
+import signal
 
-def fix_serial_permissions():
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; only the numba NMEA scanner needs it
+    np = None
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; the pure-Python parser is used
+    njit = None
+
+EARTH_RADIUS_M = 6371000.0
+
+# Kept as constants so every call hits sqlite3's prepared-statement cache
+INSERT_LOCATION_SQL = '''
+    INSERT INTO locations 
+    (patient_id, latitude, longitude, altitude, speed, timestamp, accuracy)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+INSERT_ALERT_SQL = '''
+    INSERT INTO alerts 
+    (patient_id, alert_type, message, latitude, longitude, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+def adapt_utc(value):
+    """Store datetimes as fixed-width UTC text, so string order is time order"""
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%fZ')
+
+sqlite3.register_adapter(datetime, adapt_utc)
+
+def nmea_checksum_ok(line):
+    """Validate the *XX checksum of an NMEA sentence"""
+    star = line.find(b'*')
+    if star < 1:
+        return False
+    try:
+        expected = int(line[star + 1:star + 3], 16)
+    except ValueError:
+        return False
+    return functools.reduce(operator.xor, line[1:star], 0) == expected
+
+if njit is not None:
+    @njit(cache=True)
+    def _scan_nmea(buf):
+        """Locate every sentence in a read buffer and verify its checksum
+        in one pass, returning start, '*' offset and validity arrays"""
+        n = buf.shape[0]
+        # At most one frame per '$'; njit code has no bounds checks, so size exactly
+        size = 0
+        for i in range(n):
+            if buf[i] == 36:  # '$'
+                size += 1
+        starts = np.empty(size, dtype=np.int32)
+        stars = np.empty(size, dtype=np.int32)
+        valid = np.zeros(size, dtype=np.bool_)
+        count = 0
+        i = 0
+        while i < n:
+            if buf[i] != 36:  # '$'
+                i += 1
+                continue
+            checksum = 0
+            j = i + 1
+            while j < n and buf[j] != 42 and buf[j] != 36 and buf[j] != 10:
+                checksum ^= buf[j]
+                j += 1
+            if j + 2 < n and buf[j] == 42:
+                expected = 0
+                for k in range(j + 1, j + 3):
+                    c = buf[k]
+                    if 48 <= c <= 57:
+                        expected = expected * 16 + c - 48
+                    elif 65 <= c <= 70:
+                        expected = expected * 16 + c - 55
+                    elif 97 <= c <= 102:
+                        expected = expected * 16 + c - 87
+                    else:
+                        expected = -1
+                        break
+                starts[count] = i
+                stars[count] = j
+                valid[count] = expected == checksum
+                count += 1
+            i = j
+        return starts[:count], stars[:count], valid[:count]
+else:
+    _scan_nmea = None
+
+def iter_nmea(gps_data, wanted):
+    """Yield the fields of each checksummed sentence whose type is wanted.
+    
+    Works on the raw bytes read from the port; fields stay bytes, which
+    int() and float() accept directly.
+    """
+    if _scan_nmea is None:
+        for line in gps_data.split(b'\n'):
+            line = line.strip()
+            if line[:1] == b'$' and line[1:6] in wanted and nmea_checksum_ok(line):
+                yield line[:line.find(b'*')].split(b',')
+        return
+    starts, stars, valid = _scan_nmea(np.frombuffer(gps_data, dtype=np.uint8))
+    for start, star, ok in zip(starts.tolist(), stars.tolist(), valid.tolist()):
+        if ok and gps_data[start + 1:start + 6] in wanted:
+            yield gps_data[start:star].split(b',')
+
+def nmea_degrees(value, hemisphere, width):
+    """Convert a (D)DDMM.MMMM field to signed decimal degrees"""
+    if not value:
+        return None
+    degrees = int(value[:width]) + float(value[width:]) / 60.0
+    return -degrees if hemisphere in (b'S', b'W') else degrees
+
+# Fixed field layouts: (key, conversion, field index[, hemisphere index]).
+# Latitude and longitude are required; a sentence without them has no fix.
+_GGA_SPEC = (
+    ('latitude', 'lat', 2, 3),
+    ('longitude', 'lon', 4, 5),
+    ('altitude', 'float', 9),
+    ('fix_quality', 'int', 6),
+    ('satellites', 'int', 7),
+)
+_RMC_SPEC = (
+    ('latitude', 'lat', 3, 4),
+    ('longitude', 'lon', 5, 6),
+    ('speed', 'float', 7),
+    ('fix_valid', 'active', 2),
+)
+
+_CONVERSIONS = {
+    'lat': 'nmea_degrees(f[{0}], f[{1}], 2)',
+    'lon': 'nmea_degrees(f[{0}], f[{1}], 3)',
+    'float': '(float(f[{0}]) if f[{0}] else None)',
+    'int': 'int(f[{0}] or 0)',
+    'active': "(f[{0}] == b'A')",
+}
+
+def _compile_spec(name, spec):
+    """Generate a straight-line extractor for one sentence layout"""
+    body = [f'def {name}(f):']
+    for key, kind, *fields in spec:
+        body.append(f'    {key} = {_CONVERSIONS[kind].format(*fields)}')
+    body.append('    if latitude is None or longitude is None:')
+    body.append('        return None')
+    items = ', '.join(f"'{key}': {key}" for key, _, *_ in spec)
+    body.append(f"    return {{{items}}}")
+    namespace = {'nmea_degrees': nmea_degrees}
+    exec('\n'.join(body), namespace)
+    parser = namespace[name]
+    parser.min_fields = max(max(fields) for _, _, *fields in spec) + 1
+    return parser
+
+_SENTENCE_PARSERS = {
+    b'$GPGGA': _compile_spec('_parse_gga', _GGA_SPEC),
+    b'$GPRMC': _compile_spec('_parse_rmc', _RMC_SPEC),
+}
+
+@functools.lru_cache(maxsize=None)
+def fix_serial_permissions(port='/dev/ttyS0'):
     """Attempt to fix serial port permissions"""
     print("[PERMISSION] Checking serial port access...")
     
-    # Check if we can access /dev/ttyS0
+    # Check if we can access the port
+    if os.access(port, os.R_OK | os.W_OK):
+        print(f"✓ Can access {port}")
+        return True
+    print(f"✗ Permission denied for {port}")
+    
+    # Check dialout membership in-process before forking anything
     try:
-        with open('/dev/ttyS0', 'r') as f:
-            pass
-        print("✓ Can access /dev/ttyS0")
+        dialout = grp.getgrnam('dialout')
+        in_dialout = dialout.gr_gid in os.getgroups() or dialout.gr_gid == os.getegid()
+        pending = pwd.getpwuid(os.getuid()).pw_name in dialout.gr_mem and not in_dialout
+        port_gid = os.stat(port).st_gid
+    except (KeyError, OSError):
+        dialout = None
+        in_dialout = pending = False
+        port_gid = None
+    
+    # Membership of the group that owns the port is what grants access;
+    # sudo is only forked when the current session doesn't have that
+    if in_dialout and dialout and port_gid == dialout.gr_gid:
+        print("✓ User is in dialout group")
         return True
-    except PermissionError:
-        print("✗ Permission denied for /dev/ttyS0")
     
-    # Try to fix permissions
-    print("[PERMISSION] Attempting to fix...")
+    if pending:
+        print("✗ User was added to dialout but this session predates it")
+        print("  Logout and login again, or run: newgrp dialout")
+    elif in_dialout:
+        print("✓ User is in dialout group")
+        print(f"  ⚠️  {port} is not owned by the dialout group")
     
-    # Method 1: Try to change permissions
+    # Last resort: change permissions
+    print("[PERMISSION] Attempting to fix...")
     try:
-        subprocess.run(['sudo', 'chmod', '666', '/dev/ttyS0'], check=True, capture_output=True)
-        print("✓ Changed /dev/ttyS0 permissions")
+        subprocess.run(['sudo', 'chmod', '666', port], check=True, capture_output=True)
+        print(f"✓ Changed {port} permissions")
         return True
     except:
         print("✗ Could not change permissions with chmod")
     
-    # Method 2: Check if user is in dialout group
-    try:
-        result = subprocess.run(['groups'], capture_output=True, text=True)
-        if 'dialout' in result.stdout:
-            print("✓ User is in dialout group")
-            return True
-        else:
-            print("✗ User not in dialout group")
-            print("  Run: sudo usermod -a -G dialout $USER")
-            print("  Then logout and login again")
-    except:
-        pass
-    
+    if not in_dialout and not pending:
+        print("✗ User not in dialout group")
+        print("  Run: sudo usermod -a -G dialout $USER")
+        print("  Then logout and login again")
     return False
 
 class PatientTracker:
@@ -101,16 +272,32 @@ class PatientTracker:
         self.geofence_lon = -74.0060
         self.geofence_radius = 100
         
+        # The geofence center is fixed, so its trig terms are computed once
+        self._gf_lat_r = math.radians(self.geofence_lat)
+        self._gf_lon_r = math.radians(self.geofence_lon)
+        self._gf_cos = math.cos(self._gf_lat_r)
+        
         # Serial ports
         self.gps_serial = None
         self.gsm_serial = None
+        self._gps_tail = b''
         
         # Database
         self.db_conn = None
+        self.batch_size = 10
+        self.flush_interval = 30
+        self._wq = queue.SimpleQueue()
         
         # Tracking state
         self.is_tracking = False
         self.current_location = None
+        self._latest_fix = None
+        self._loop_count = 0
+        
+        # Written to by stop_tracking and signals to wake the event loop
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
         
         # Initialize components
         self.initialize_database()
@@ -126,12 +313,20 @@ class PatientTracker:
         """Initialize SQLite database"""
         try:
             print("\n[DATABASE] Initializing...")
-            self.db_conn = sqlite3.connect('patient_tracking.db', check_same_thread=False)
-            cursor = self.db_conn.cursor()
+            self.db_conn = sqlite3.connect('patient_tracking.db', check_same_thread=False,
+                                           cached_statements=64)
+            self.db_conn.executescript('''
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                PRAGMA busy_timeout=5000;
+                PRAGMA temp_store=MEMORY;
+                PRAGMA cache_size=-8192;
+                PRAGMA mmap_size=67108864;
+            ''')
             
-            cursor.execute('''
+            self.db_conn.execute('''
                 CREATE TABLE IF NOT EXISTS locations (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id INTEGER PRIMARY KEY,
                     patient_id TEXT,
                     latitude REAL,
                     longitude REAL,
@@ -142,9 +337,9 @@ class PatientTracker:
                 )
             ''')
             
-            cursor.execute('''
+            self.db_conn.execute('''
                 CREATE TABLE IF NOT EXISTS alerts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id INTEGER PRIMARY KEY,
                     patient_id TEXT,
                     alert_type TEXT,
                     message TEXT,
@@ -155,7 +350,17 @@ class PatientTracker:
                 )
             ''')
             
+            self.db_conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_loc_pid_ts ON locations(patient_id, timestamp)
+            ''')
+            self.db_conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_alerts_pid_ts ON alerts(patient_id, timestamp)
+            ''')
+            
             self.db_conn.commit()
+            
+            self._writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+            self._writer_thread.start()
             print("✓ Database initialized successfully")
             
         except Exception as e:
@@ -178,7 +383,7 @@ class PatientTracker:
                 self.gsm_serial = serial.Serial(
                     self.gsm_port,
                     self.gsm_baudrate,
-                    timeout=1
+                    timeout=3
                 )
                 print(f"✓ GSM connected on {self.gsm_port}")
                 self.test_gsm_module()
@@ -216,55 +421,43 @@ class PatientTracker:
         except Exception as e:
             print(f"✗ GSM test failed: {e}")
     
-    def send_gsm_command(self, command, wait_time=1):
+    def send_gsm_command(self, command, expected=b'OK\r\n'):
         """Send command to GSM module and return response"""
         if not self.gsm_serial:
             return ''
             
         try:
+            self.gsm_serial.reset_input_buffer()
             self.gsm_serial.write((command + '\r\n').encode())
-            time.sleep(wait_time)
-            response = ''
-            while self.gsm_serial.in_waiting > 0:
-                response += self.gsm_serial.read(self.gsm_serial.in_waiting).decode()
-            return response.strip()
+            # Returns as soon as the modem answers, or after the port timeout
+            response = self.gsm_serial.read_until(expected, 512)
+            return response.decode(errors='ignore').strip()
         except Exception as e:
             print(f"GSM command failed: {command} - {e}")
             return ''
     
     def parse_gps_data(self, gps_data):
         """Parse NMEA GPS data"""
-        try:
-            for line in gps_data.split('\n'):
-                if line.startswith('$GPGGA'):
-                    msg = pynmea2.parse(line)
-                    return {
-                        'latitude': msg.latitude,
-                        'longitude': msg.longitude,
-                        'altitude': msg.altitude,
-                        'timestamp': datetime.now(),
-                        'fix_quality': msg.gps_qual,
-                        'satellites': msg.num_sats
-                    }
-                elif line.startswith('$GPRMC'):
-                    msg = pynmea2.parse(line)
-                    return {
-                        'latitude': msg.latitude,
-                        'longitude': msg.longitude,
-                        'speed': msg.spd_over_grnd,
-                        'timestamp': datetime.now(),
-                        'fix_valid': msg.is_valid
-                    }
-        except Exception as e:
-            print(f"GPS parsing error: {e}")
+        for fields in iter_nmea(gps_data, (b'GPGGA', b'GPRMC')):
+            parser = _SENTENCE_PARSERS[fields[0]]
+            if len(fields) < parser.min_fields:
+                continue
+            try:
+                return parser(fields)
+            except ValueError as e:
+                print(f"GPS parsing error: {e}")
         return None
     
     def get_gps_location(self):
         """Get current GPS location"""
         try:
             if self.gps_serial.in_waiting > 0:
-                gps_data = self.gps_serial.read(self.gps_serial.in_waiting).decode()
-                location = self.parse_gps_data(gps_data)
+                # Parse whole lines only; a trailing partial sentence is kept
+                # for the next read instead of being cut in half
+                data = self._gps_tail + self.gps_serial.read(self.gps_serial.in_waiting)
+                end = data.rfind(b'\n') + 1
+                self._gps_tail = data[end:][-512:]
+                location = self.parse_gps_data(data[:end])
                 if location:
                     self.current_location = location
                     return location
@@ -273,50 +466,75 @@ class PatientTracker:
         return None
     
     def store_location(self, location):
-        """Store location data in database"""
+        """Queue location data for the database writer thread"""
+        self._wq.put(('location', (
+            self.patient_id,
+            location.get('latitude'),
+            location.get('longitude'),
+            location.get('altitude'),
+            location.get('speed'),
+            location.get('timestamp'),
+            location.get('accuracy', 10.0)
+        )))
+    
+    def _writer_loop(self):
+        """Write queued rows in batches until a None sentinel arrives"""
+        locations = []
+        flush_at = None
+        running = True
+        while running:
+            timeout = None if flush_at is None else max(0.0, flush_at - time.monotonic())
+            try:
+                item = self._wq.get(timeout=timeout)
+            except queue.Empty:
+                item = ('flush', None)
+            
+            alert = None
+            if item is None:
+                running = False
+            elif item[0] == 'location':
+                locations.append(item[1])
+                if flush_at is None:
+                    flush_at = time.monotonic() + self.flush_interval
+            elif item[0] == 'alert':
+                alert = item[1]
+            
+            # Alerts are written straight away, together with any fixes
+            # queued before them
+            if (alert or not running or len(locations) >= self.batch_size or
+                    (flush_at is not None and time.monotonic() >= flush_at)):
+                self._write_rows(locations, alert)
+                locations = []
+                flush_at = None
+    
+    def _write_rows(self, locations, alert=None):
+        """Write locations and an optional alert in a single transaction"""
         try:
-            cursor = self.db_conn.cursor()
-            cursor.execute('''
-                INSERT INTO locations 
-                (patient_id, latitude, longitude, altitude, speed, timestamp, accuracy)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                self.patient_id,
-                location.get('latitude'),
-                location.get('longitude'),
-                location.get('altitude'),
-                location.get('speed'),
-                location.get('timestamp'),
-                location.get('accuracy', 10.0)
-            ))
-            self.db_conn.commit()
+            with self.db_conn:
+                if locations:
+                    self.db_conn.executemany(INSERT_LOCATION_SQL, locations)
+                if alert:
+                    self.db_conn.execute(INSERT_ALERT_SQL, alert)
         except Exception as e:
             print(f"Database storage error: {e}")
     
-    def check_geofence(self, location):
+    def check_geofence(self, location, now=None):
         """Check if patient is within geofence"""
         if not self.geofence_enabled:
             return True
         
         try:
-            import math
-            
             lat1 = math.radians(location['latitude'])
-            lon1 = math.radians(location['longitude'])
-            lat2 = math.radians(self.geofence_lat)
-            lon2 = math.radians(self.geofence_lon)
-            
-            dlat = lat2 - lat1
-            dlon = lon2 - lon1
-            a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-            c = 2 * math.asin(math.sqrt(a))
-            r = 6371
-            distance = c * r * 1000
+            dlat = self._gf_lat_r - lat1
+            dlon = self._gf_lon_r - math.radians(location['longitude'])
+            a = math.sin(dlat/2)**2 + math.cos(lat1) * self._gf_cos * math.sin(dlon/2)**2
+            distance = 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
             
             if distance > self.geofence_radius:
                 self.trigger_alert('GEOFENCE_BREACH', 
                                  f"Patient left safe area. Distance: {distance:.2f}m",
-                                 location['latitude'], location['longitude'])
+                                 location['latitude'], location['longitude'],
+                                 now=now or location.get('timestamp'))
                 return False
             
             return True
@@ -325,103 +543,199 @@ class PatientTracker:
             print(f"Geofence check error: {e}")
             return True
     
-    def trigger_alert(self, alert_type, message, latitude, longitude):
+    def trigger_alert(self, alert_type, message, latitude, longitude, now=None):
         """Trigger alert and send notifications"""
         try:
+            if now is None:
+                now = datetime.now(timezone.utc)
             print(f"\n🚨 ALERT: {alert_type}")
             print(f"   Message: {message}")
             print(f"   Location: {latitude:.6f}, {longitude:.6f}")
-            print(f"   Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+            print(f"   Time: {now.astimezone().strftime('%Y-%m-%d %H:%M:%S')}")
             
-            cursor = self.db_conn.cursor()
-            cursor.execute('''
-                INSERT INTO alerts 
-                (patient_id, alert_type, message, latitude, longitude, timestamp)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (self.patient_id, alert_type, message, latitude, longitude, datetime.now()))
-            self.db_conn.commit()
+            self._wq.put(('alert', (self.patient_id, alert_type, message,
+                                    latitude, longitude, now)))
             
             if self.gsm_serial:
-                for number in self.emergency_numbers:
-                    print(f"   Sending SMS to {number}...")
-                    self.send_sms_alert(number, f"ALERT: {message}")
+                self.send_sms_alert(self.emergency_numbers, f"ALERT: {message}")
             else:
                 print("   ⚠️  GSM not available - SMS not sent")
             
         except Exception as e:
             print(f"Alert triggering failed: {e}")
     
-    def send_sms_alert(self, phone_number, message):
-        """Send SMS alert via GSM module"""
+    def send_sms_alert(self, phone_numbers, message):
+        """Send SMS alert to every recipient via GSM module.
+        
+        The body is written to modem storage once (AT+CMGW) and sent to each
+        number with AT+CMSS; modems that refuse to store it get one AT+CMGS
+        per number instead.
+        """
         if not self.gsm_serial:
             return
-            
+        
         try:
-            self.send_gsm_command(f'AT+CMGS="{phone_number}"', wait_time=2)
+            index = self._store_sms(message)
+        except Exception as e:
+            print(f"   ⚠️  Could not store SMS on modem: {e}")
+            index = None
+        
+        for number in phone_numbers:
+            print(f"   Sending SMS to {number}...")
+            if index is None:
+                self._send_sms_direct(number, message)
+                continue
+            try:
+                response = self.send_gsm_command(f'AT+CMSS={index},"{number}"')
+                if '+CMSS' not in response:
+                    response += self._read_gsm_final().decode(errors='ignore')
+                if 'ERROR' in response or '+CMSS' not in response:
+                    print(f"   ✗ SMS sending failed: {response.strip()}")
+                    continue
+                print(f"   ✓ SMS sent to {number}")
+            except Exception as e:
+                print(f"   ✗ SMS sending failed: {e}")
+        
+        if index is not None:
+            self.send_gsm_command(f'AT+CMGD={index}')
+    
+    def _store_sms(self, message):
+        """Write an SMS body to modem storage, returning its index"""
+        prompt = self.send_gsm_command('AT+CMGW', expected=b'>')
+        if not prompt.endswith('>'):
+            return None
+        self.gsm_serial.write((message + '\x1A').encode())
+        match = re.search(rb'\+CMGW:\s*(\d+)', self._read_gsm_final())
+        return int(match.group(1)) if match else None
+    
+    def _read_gsm_final(self, attempts=10):
+        """Read until OK or ERROR; network sends can outlast one port timeout"""
+        response = bytearray()
+        for _ in range(attempts):
+            response += self.gsm_serial.read_until(b'OK\r\n', 512)
+            if b'OK' in response or b'ERROR' in response:
+                break
+        return response
+    
+    def _send_sms_direct(self, phone_number, message):
+        """Send one SMS with AT+CMGS, typing the body for this recipient"""
+        try:
+            prompt = self.send_gsm_command(f'AT+CMGS="{phone_number}"', expected=b'>')
+            if not prompt.endswith('>'):
+                print(f"   ✗ SMS sending failed: no prompt from modem ({prompt})")
+                return
             self.gsm_serial.write((message + '\x1A').encode())
-            time.sleep(2)
-            response = self.send_gsm_command('', wait_time=2)
+            response = self._read_gsm_final()
+            if b'ERROR' in response or b'OK' not in response:
+                print(f"   ✗ SMS sending failed: {response.decode(errors='ignore').strip()}")
+                return
             print(f"   ✓ SMS sent to {phone_number}")
         except Exception as e:
             print(f"   ✗ SMS sending failed: {e}")
     
-    def tracking_loop(self):
-        """Main tracking loop with terminal output"""
+    def run(self):
+        """Main tracking loop with terminal output.
+        
+        A single selector drives everything: GPS bytes are read as they
+        arrive and the status/storage update fires every update_interval.
+        """
         print(f"\n[TRACKING] Starting patient tracking...")
         print(f"   Update interval: {self.update_interval} seconds")
         print(f"   Press Ctrl+C to stop")
         print("-" * 60)
         
-        loop_count = 0
-        while self.is_tracking:
-            try:
-                loop_count += 1
-                print(f"\n[{datetime.now().strftime('%H:%M:%S')}] Update #{loop_count}")
+        self.is_tracking = True
+        sel = selectors.DefaultSelector()
+        sel.register(self.gps_serial.fileno(), selectors.EVENT_READ, self._on_gps)
+        sel.register(self._wake_r, selectors.EVENT_READ, self._on_wake)
+        # Signals interrupt select() via the wake socket (main thread only)
+        if threading.current_thread() is threading.main_thread():
+            signal.set_wakeup_fd(self._wake_w.fileno())
+        
+        next_tick = time.monotonic()
+        try:
+            while self.is_tracking:
+                for key, _ in sel.select(max(0.0, next_tick - time.monotonic())):
+                    key.data()
+                if self.is_tracking and time.monotonic() >= next_tick:
+                    next_tick = time.monotonic() + self._on_tick()
+        finally:
+            if threading.current_thread() is threading.main_thread():
+                signal.set_wakeup_fd(-1)
+            sel.close()
+    
+    def _on_gps(self):
+        """Keep the newest fix from whatever GPS bytes are waiting"""
+        location = self.get_gps_location()
+        if location:
+            self._latest_fix = location
+    
+    def _on_wake(self):
+        """Drain wake-up bytes; the loop rechecks is_tracking afterwards"""
+        try:
+            while self._wake_r.recv(64):
+                pass
+        except BlockingIOError:
+            pass
+    
+    def _on_tick(self):
+        """Report, store and geofence-check the newest fix; returns the
+        delay until the next tick"""
+        try:
+            self._loop_count += 1
+            # Each tick's status goes out as one write rather than a
+            # print() per line
+            now = datetime.now(timezone.utc)
+            lines = [f"\n[{now.astimezone().strftime('%H:%M:%S')}] Update #{self._loop_count}"]
+            
+            location, self._latest_fix = self._latest_fix, None
+            
+            if location:
+                # One clock read per tick stamps the fix, its row and
+                # any alert it raises
+                location['timestamp'] = now
+                lines.append(f"   📍 Location: {location['latitude']:.6f}, {location['longitude']:.6f}")
+                if location.get('altitude'):
+                    lines.append(f"   🏔️  Altitude: {location['altitude']:.1f}m")
+                if location.get('speed'):
+                    lines.append(f"   🚗 Speed: {location['speed']:.1f} knots")
+                if location.get('satellites'):
+                    lines.append(f"   🛰️  Satellites: {location['satellites']}")
                 
-                location = self.get_gps_location()
+                self.store_location(location)
+                lines.append("   💾 Location saved to database")
                 
-                if location:
-                    print(f"   📍 Location: {location['latitude']:.6f}, {location['longitude']:.6f}")
-                    if location.get('altitude'):
-                        print(f"   🏔️  Altitude: {location['altitude']:.1f}m")
-                    if location.get('speed'):
-                        print(f"   🚗 Speed: {location['speed']:.1f} knots")
-                    if location.get('satellites'):
-                        print(f"   🛰️  Satellites: {location['satellites']}")
-                    
-                    self.store_location(location)
-                    print("   💾 Location saved to database")
-                    
-                    geofence_status = self.check_geofence(location)
-                    if geofence_status:
-                        print("   ✅ Within safe area")
-                    
-                else:
-                    print("   ⚠️  No GPS data available")
-                    print("   📡 Waiting for satellite lock...")
+                # Alerts print their own block, so emit ours first
+                self.write_status(lines)
+                lines = []
+                geofence_status = self.check_geofence(location, now)
+                if geofence_status:
+                    lines.append("   ✅ Within safe area")
                 
-                print(f"   ⏳ Next update in {self.update_interval} seconds...")
-                time.sleep(self.update_interval)
-                
-            except KeyboardInterrupt:
-                break
-            except Exception as e:
-                print(f"   ✗ Tracking error: {e}")
-                time.sleep(5)
+            else:
+                lines.append("   ⚠️  No GPS data available")
+                lines.append("   📡 Waiting for satellite lock...")
+            
+            lines.append(f"   ⏳ Next update in {self.update_interval} seconds...")
+            self.write_status(lines)
+            return self.update_interval
+            
+        except Exception as e:
+            print(f"   ✗ Tracking error: {e}")
+            return 5
     
-    def start_tracking(self):
-        """Start patient tracking"""
-        if not self.is_tracking:
-            self.is_tracking = True
-            self.tracking_thread = threading.Thread(target=self.tracking_loop)
-            self.tracking_thread.daemon = True
-            self.tracking_thread.start()
+    def write_status(self, lines):
+        """Write a block of status lines to stdout in one call"""
+        sys.stdout.write('\n'.join(lines) + '\n')
+        sys.stdout.flush()
     
     def stop_tracking(self):
         """Stop patient tracking"""
         self.is_tracking = False
-        if hasattr(self, 'tracking_thread'):
-            self.tracking_thread.join()
+        try:
+            self._wake_w.send(b'\0')
+        except OSError:
+            pass
     
     def cleanup(self):
         """Cleanup resources"""
@@ -435,30 +749,40 @@ class PatientTracker:
                 self.gsm_serial.close()
                 print("✓ GSM port closed")
             if self.db_conn:
+                if hasattr(self, '_writer_thread'):
+                    self._wq.put(None)
+                    self._writer_thread.join(timeout=10)
                 self.db_conn.close()
                 print("✓ Database closed")
+            self._wake_r.close()
+            self._wake_w.close()
             print("✓ Cleanup completed")
         except Exception as e:
             print(f"✗ Cleanup error: {e}")
 
+shutdown_event = threading.Event()
+
 def signal_handler(sig, frame):
     """Handle Ctrl+C gracefully"""
     print('\n\n[SHUTDOWN] Received interrupt signal...')
-    tracker.cleanup()
-    exit(0)
+    shutdown_event.set()
+    if 'tracker' in globals():
+        tracker.stop_tracking()
 
 if __name__ == "__main__":
-    signal(SIGINT, signal_handler)
+    signal.signal(signal.SIGINT, signal_handler)
     
     try:
         tracker = PatientTracker()
-        tracker.start_tracking()
         
-        while True:
-            time.sleep(1)
+        # Runs on the main thread until a signal stops it
+        if not shutdown_event.is_set():
+            tracker.run()
+        tracker.cleanup()
+        sys.exit(0)
             
     except Exception as e:
         print(f"\n[ERROR] Fatal error: {e}")
         if 'tracker' in locals():
             tracker.cleanup()
-        exit(1)
+        sys.exit(1)
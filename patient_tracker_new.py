@@ -9,11 +9,17 @@ import time
 import sqlite3
 import threading
 import math
-from datetime import datetime
+from datetime import datetime, timezone
 import pynmea2
 from signal import signal, SIGINT
 from sys import exit
 
+def adapt_utc(value):
+    """Store datetimes as fixed-width UTC text, so string order is time order"""
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%fZ')
+
+sqlite3.register_adapter(datetime, adapt_utc)
+
 class PatientTracker:
     def __init__(self):
         print("=" * 60)
@@ -227,7 +233,7 @@ class PatientTracker:
                             'latitude': msg.latitude,
                             'longitude': msg.longitude,
                             'altitude': msg.altitude,
-                            'timestamp': datetime.now(),
+                            'timestamp': datetime.now(timezone.utc),
                             'satellites': msg.num_sats,
                             'fix_quality': msg.gps_qual,
                             'hdop': getattr(msg, 'hdop', None)
@@ -238,7 +244,7 @@ class PatientTracker:
                             'latitude': msg.latitude,
                             'longitude': msg.longitude,
                             'speed': msg.spd_over_grnd * 1.852 if msg.spd_over_grnd else 0,  # Convert knots to km/h
-                            'timestamp': datetime.now(),
+                            'timestamp': datetime.now(timezone.utc),
                             'fix_valid': msg.is_valid
                         }
                 except pynmea2.ParseError:
@@ -351,7 +357,7 @@ class PatientTracker:
                 INSERT INTO alerts 
                 (patient_id, alert_type, message, latitude, longitude, timestamp)
                 VALUES (?, ?, ?, ?, ?, ?)
-            ''', (self.patient_id, alert_type, message, latitude, longitude, datetime.now()))
+            ''', (self.patient_id, alert_type, message, latitude, longitude, datetime.now(timezone.utc)))
             self.db_conn.commit()
             
             # Send SMS alerts
@@ -410,7 +416,7 @@ class PatientTracker:
             cursor.execute('''
                 INSERT INTO system_status (component, status, message, timestamp)
                 VALUES (?, ?, ?, ?)
-            ''', (component, status, message, datetime.now()))
+            ''', (component, status, message, datetime.now(timezone.utc)))
             self.db_conn.commit()
         except Exception as e:
             pass  # Silent fail for logging
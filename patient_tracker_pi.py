@@ -9,16 +9,168 @@ Date: 2025
 import serial
 import time
 import json
+from math import radians, sin, cos, asin, sqrt, hypot
 import sqlite3
 import threading
+import queue
 import logging
-from datetime import datetime
-import pynmea2
+from collections import deque
+from itertools import groupby
+from datetime import datetime, timezone
 import requests
 import os
-from signal import signal, SIGINT
+import sys
+import selectors
+import socket
+from signal import signal, pause, SIGINT
 from sys import exit
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional (and unavailable on the Pi Zero's ARMv6)
+    njit = None
+
+# Statement text is kept constant so sqlite3's statement cache reuses the compiled form
+INSERT_LOCATION_SQL = '''
+    INSERT INTO locations 
+    (patient_id, latitude, longitude, altitude, speed, timestamp, accuracy)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+INSERT_ALERT_SQL = '''
+    INSERT INTO alerts 
+    (patient_id, alert_type, message, latitude, longitude, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+# Every table and index in one script, created in a single transaction
+SCHEMA_SQL = '''
+    BEGIN;
+
+    CREATE TABLE IF NOT EXISTS locations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id TEXT,
+        latitude REAL,
+        longitude REAL,
+        altitude REAL,
+        speed REAL,
+        timestamp DATETIME,
+        accuracy REAL
+    );
+
+    CREATE TABLE IF NOT EXISTS alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id TEXT,
+        alert_type TEXT,
+        message TEXT,
+        latitude REAL,
+        longitude REAL,
+        timestamp DATETIME,
+        resolved BOOLEAN DEFAULT 0
+    );
+
+    CREATE TABLE IF NOT EXISTS system_status (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        component TEXT,
+        status TEXT,
+        message TEXT,
+        timestamp DATETIME
+    );
+
+    -- Latest-fixes and open-alerts lookups per patient
+    CREATE INDEX IF NOT EXISTS idx_loc_patient_time
+    ON locations(patient_id, timestamp DESC);
+
+    CREATE INDEX IF NOT EXISTS idx_alerts_patient_time
+    ON alerts(patient_id, timestamp DESC) WHERE resolved = 0;
+
+    COMMIT;
+'''
+
+def adapt_utc(value):
+    """Store datetimes as fixed-width UTC text, so string order is time order"""
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%fZ')
+
+sqlite3.register_adapter(datetime, adapt_utc)
+
+# Fixed AT commands are encoded once; send_gsm_command writes bytes as-is
+AT_CHECK = b'AT\r\n'
+AT_INFO = b'ATI\r\n'
+AT_SIGNAL = b'AT+CSQ\r\n'
+AT_TEXT_MODE = b'AT+CMGF=1\r\n'
+SMS_TERMINATOR = b'\x1A'  # Ctrl+Z ends the message body
+
+def _haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters between two points given in degrees"""
+    lat1 = radians(lat1)
+    lat2 = radians(lat2)
+    sdlat = sin((lat2 - lat1) * 0.5)
+    sdlon = sin(radians(lon2 - lon1) * 0.5)
+    a = sdlat * sdlat + cos(lat1) * cos(lat2) * sdlon * sdlon
+    return 12742000.0 * asin(sqrt(a))
+
+def _nmea_coord_to_deg(value, negative):
+    """Convert an NMEA ddmm.mmmm number to signed decimal degrees"""
+    degrees = int(value / 100.0)
+    degrees = degrees + (value - degrees * 100.0) / 60.0
+    return -degrees if negative else degrees
+
+# The numeric kernels compile to native code where numba is installed
+if njit is not None:
+    _haversine_m = njit(cache=True, fastmath=True)(_haversine_m)
+    _nmea_coord_to_deg = njit(cache=True)(_nmea_coord_to_deg)
+
+def _nmea_degrees(value, hemisphere):
+    """Convert an NMEA (d)ddmm.mmmm field to signed decimal degrees (0.0 if empty)"""
+    if not value:
+        return 0.0
+    return _nmea_coord_to_deg(float(value), hemisphere in ('S', 'W'))
+
+def _nmea_checksum_ok(line):
+    """XOR every character between '$' and '*' and compare with the hex suffix"""
+    star = line.rfind('*')
+    if star < 0:
+        return False
+    checksum = 0
+    for char in line[1:star]:
+        checksum ^= ord(char)
+    try:
+        return checksum == int(line[star + 1:star + 3], 16)
+    except ValueError:
+        return False
+
+def _parse_gga(fields):
+    """Location fields from a split $GPGGA sentence"""
+    if len(fields) < 10:
+        return None
+    return {
+        'latitude': _nmea_degrees(fields[2], fields[3]),
+        'longitude': _nmea_degrees(fields[4], fields[5]),
+        'altitude': float(fields[9]) if fields[9] else None,
+        'timestamp': datetime.now(timezone.utc),
+        'fix_quality': int(fields[6]) if fields[6] else 0,
+        'satellites': int(fields[7]) if fields[7] else 0
+    }
+
+def _parse_rmc(fields):
+    """Location fields from a split $GPRMC sentence"""
+    if len(fields) < 8:
+        return None
+    return {
+        'latitude': _nmea_degrees(fields[3], fields[4]),
+        'longitude': _nmea_degrees(fields[5], fields[6]),
+        'speed': float(fields[7]) if fields[7] else None,
+        'timestamp': datetime.now(timezone.utc),
+        'fix_valid': fields[2] == 'A'
+    }
+
+# Sentence tag -> field parser; GN* is the multi-constellation talker of newer modules
+_NMEA_HANDLERS = {
+    '$GPGGA': _parse_gga,
+    '$GNGGA': _parse_gga,
+    '$GPRMC': _parse_rmc,
+    '$GNRMC': _parse_rmc,
+}
+
 class PatientTracker:
     def __init__(self):
         print("=" * 60)
@@ -32,6 +184,7 @@ class PatientTracker:
         self.gsm_port = "/dev/ttyUSB0"
         self.gsm_baudrate = 115200
         self.update_interval = 10  # seconds
+        self.verbose = False  # per-fix detail lines; the Pi's serial console is slow
         self.emergency_numbers = ["+918848776875", "+9175929912412"]
         
         # Geofence configuration (hardcoded)
@@ -40,12 +193,35 @@ class PatientTracker:
         self.geofence_lon = -74.0060
         self.geofence_radius = 100  # meters
         
+        # The center is fixed, so the local meters-per-degree scale is computed once
+        self._gf_lat_rad = radians(self.geofence_lat)
+        self._gf_cos_lat = cos(self._gf_lat_rad)
+        self._m_per_deg_lat = radians(6371000)  # same sphere as the Haversine path
+        self._m_per_deg_lon = self._m_per_deg_lat * self._gf_cos_lat
+        # Flat-earth distance is exact to millimeters at small radii; use Haversine beyond 5 km
+        self._gf_haversine = self.geofence_radius > 5000
+        
         # Serial ports
         self.gps_serial = None
         self.gsm_serial = None
         
+        # GPS receive path: the tracking selector splits UART bytes into lines
+        self._nmea_buf = bytearray()
+        self._nmea_lines = deque(maxlen=64)
+        # Lets stop_tracking interrupt the selector wait
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        
         # Database
         self.db_conn = None
+        # Rows are committed by a writer thread, so SD-card stalls never block the tracking loop
+        self._wqueue = queue.Queue(maxsize=1024)
+        self._flush_threshold = 20  # rows per commit
+        self._flush_interval = 60  # seconds; upper bound on unsaved fixes
+        # A stationary patient only gets a heartbeat row, not one per update
+        self.min_move_distance = 3  # meters
+        self.heartbeat_interval = 300  # seconds
+        self._last_stored = None  # (lat, lon, monotonic time) of the last stored fix
         
         # Tracking state
         self.is_tracking = False
@@ -53,6 +229,9 @@ class PatientTracker:
         
         # Initialize components
         self.initialize_database()
+        self.db_thread = threading.Thread(target=self.db_writer_loop)
+        self.db_thread.daemon = True
+        self.db_thread.start()
         self.initialize_hardware()
         
         print(f"✓ Patient ID: {self.patient_id}")
@@ -65,47 +244,30 @@ class PatientTracker:
         """Initialize SQLite database"""
         try:
             print("\n[DATABASE] Initializing...")
-            self.db_conn = sqlite3.connect('patient_tracking.db', check_same_thread=False)
+            db_path = 'patient_tracking.db'
+            self.db_conn = sqlite3.connect(db_path, check_same_thread=False)
             cursor = self.db_conn.cursor()
             
-            # Create tables
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS locations (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patient_id TEXT,
-                    latitude REAL,
-                    longitude REAL,
-                    altitude REAL,
-                    speed REAL,
-                    timestamp DATETIME,
-                    accuracy REAL
-                )
-            ''')
+            # Applies directly to a fresh file; an existing one is rebuilt once to adopt it
+            cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            if cursor.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                cursor.execute('VACUUM')
             
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS alerts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patient_id TEXT,
-                    alert_type TEXT,
-                    message TEXT,
-                    latitude REAL,
-                    longitude REAL,
-                    timestamp DATETIME,
-                    resolved BOOLEAN DEFAULT 0
-                )
-            ''')
+            # WAL appends each commit instead of journalling pages twice
+            if db_path != ':memory:':
+                journal_mode = cursor.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+                if journal_mode.lower() != 'wal':
+                    print(f"✗ WAL mode unavailable, using {journal_mode} journal")
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.execute('PRAGMA busy_timeout=5000')
+            cursor.execute('PRAGMA temp_store=MEMORY')
+            cursor.execute('PRAGMA cache_size=-4000')  # 4 MB
             
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS system_status (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    component TEXT,
-                    status TEXT,
-                    message TEXT,
-                    timestamp DATETIME
-                )
-            ''')
+            # Create tables and indexes
+            cursor.executescript(SCHEMA_SQL)
             
-            self.db_conn.commit()
+            # Reused by every write instead of a fresh cursor per call
+            self._cur = cursor
             print("✓ Database initialized successfully")
             
         except Exception as e:
@@ -121,6 +283,7 @@ class PatientTracker:
                 self.gps_baudrate,
                 timeout=1
             )
+            self._set_low_latency(self.gps_serial)
             print(f"✓ GPS connected on {self.gps_port}")
             
             print("\n[GSM] Initializing GSM module...")
@@ -129,6 +292,7 @@ class PatientTracker:
                 self.gsm_baudrate,
                 timeout=1
             )
+            self._set_low_latency(self.gsm_serial)
             print(f"✓ GSM connected on {self.gsm_port}")
             
             # Test GSM module
@@ -143,13 +307,20 @@ class PatientTracker:
             print("  Try: sudo usermod -a -G dialout $USER")
             raise
     
+    def _set_low_latency(self, port):
+        """Ask the driver to pass short bursts on at once (ASYNC_LOW_LATENCY)"""
+        try:
+            port.set_low_latency_mode(True)
+        except (AttributeError, ValueError, OSError):
+            pass  # not every UART driver supports TIOCSSERIAL; latency stays at its default
+    
     def test_gsm_module(self):
         """Test GSM module connectivity"""
         try:
             print("\n[GSM] Testing module...")
             
             # Basic AT command
-            response = self.send_gsm_command('AT')
+            response = self.send_gsm_command(AT_CHECK)
             if 'OK' in response:
                 print("✓ GSM module responding")
             else:
@@ -157,66 +328,110 @@ class PatientTracker:
                 return
             
             # Get module info
-            response = self.send_gsm_command('ATI')
+            response = self.send_gsm_command(AT_INFO)
             print(f"✓ GSM Module: {response}")
             
             # Check signal strength
-            response = self.send_gsm_command('AT+CSQ')
+            response = self.send_gsm_command(AT_SIGNAL)
             print(f"✓ Signal Strength: {response}")
             
             # Set SMS mode to text
-            self.send_gsm_command('AT+CMGF=1')
+            self.send_gsm_command(AT_TEXT_MODE)
             print("✓ SMS mode set to text")
             
         except Exception as e:
             print(f"✗ GSM test failed: {e}")
     
-    def send_gsm_command(self, command, wait_time=1):
-        """Send command to GSM module and return response"""
+    def send_gsm_command(self, command, wait_time=1, expect=b'OK\r'):
+        """Send command (str, or bytes already ending in CRLF) to GSM module and return response"""
         try:
-            self.gsm_serial.write((command + '\r\n').encode())
-            time.sleep(wait_time)
-            response = ''
-            while self.gsm_serial.in_waiting > 0:
-                response += self.gsm_serial.read(self.gsm_serial.in_waiting).decode()
-            return response.strip()
+            if isinstance(command, str):
+                command = (command + '\r\n').encode()
+            self.gsm_serial.write(command)
+            return self._read_gsm_response(wait_time, expect)
         except Exception as e:
             print(f"GSM command failed: {command} - {e}")
             return ''
     
+    def _read_gsm_response(self, wait_time, expect=b'OK\r', quiet=0.02):
+        """Poll until expect/ERROR arrives, or the line goes quiet after a reply"""
+        deadline = time.monotonic() + wait_time
+        last_rx = None
+        buf = bytearray()
+        while time.monotonic() < deadline:
+            if self.gsm_serial.in_waiting:
+                buf += self.gsm_serial.read(self.gsm_serial.in_waiting)
+                last_rx = time.monotonic()
+                if expect in buf or b'ERROR' in buf:
+                    break
+            elif quiet is not None and last_rx is not None and time.monotonic() - last_rx > quiet:
+                break
+            else:
+                time.sleep(0.005)
+        return buf.decode(errors='ignore').strip()
+    
     def parse_gps_data(self, gps_data):
         """Parse NMEA GPS data"""
         try:
             for line in gps_data.split('\n'):
-                if line.startswith('$GPGGA'):
-                    msg = pynmea2.parse(line)
-                    return {
-                        'latitude': msg.latitude,
-                        'longitude': msg.longitude,
-                        'altitude': msg.altitude,
-                        'timestamp': datetime.now(),
-                        'fix_quality': msg.gps_qual,
-                        'satellites': msg.num_sats
-                    }
-                elif line.startswith('$GPRMC'):
-                    msg = pynmea2.parse(line)
-                    return {
-                        'latitude': msg.latitude,
-                        'longitude': msg.longitude,
-                        'speed': msg.spd_over_grnd,
-                        'timestamp': datetime.now(),
-                        'fix_valid': msg.is_valid
-                    }
+                line = line.strip()
+                handler = _NMEA_HANDLERS.get(line[:6])
+                if handler is None or not _nmea_checksum_ok(line):
+                    continue
+                location = handler(line[:line.rfind('*')].split(','))
+                if location:
+                    return location
         except Exception as e:
             print(f"GPS parsing error: {e}")
         return None
     
+    def _on_gps(self, fd):
+        """Read the bytes that woke the selector and queue complete NMEA lines"""
+        try:
+            data = os.read(fd, 4096)
+        except OSError as e:
+            print(f"GPS reading error: {e}")
+            time.sleep(1)
+            return
+        if not data:
+            time.sleep(0.1)  # port hung up; don't spin on it
+            return
+        buf = self._nmea_buf
+        buf += data
+        end = buf.rfind(b'\n')
+        if end >= 0:
+            self._nmea_lines.extend(bytes(buf[:end]).split(b'\n'))
+            del buf[:end + 1]
+        elif len(buf) > 4096:
+            buf.clear()  # no line ending in sight; not NMEA
+    
+    def _on_gsm(self, fd):
+        """Drain unsolicited modem output between commands"""
+        try:
+            data = os.read(fd, 4096)
+        except OSError:
+            data = b''
+        if not data:
+            time.sleep(0.1)
+        elif self.verbose:
+            self.write_lines([f"   📨 GSM: {data.decode(errors='ignore').strip()}"])
+    
+    def _on_wake(self, fd):
+        """Drain wake-up bytes; the loop rechecks is_tracking afterwards"""
+        try:
+            while self._wake_r.recv(64):
+                pass
+        except BlockingIOError:
+            pass
+    
     def get_gps_location(self):
         """Get current GPS location"""
         try:
-            if self.gps_serial.in_waiting > 0:
-                gps_data = self.gps_serial.read(self.gps_serial.in_waiting).decode()
-                location = self.parse_gps_data(gps_data)
+            lines = list(self._nmea_lines)
+            self._nmea_lines.clear()
+            # Newest sentence first
+            for line in reversed(lines):
+                location = self.parse_gps_data(line.decode('ascii', 'ignore'))
                 if location:
                     self.current_location = location
                     return location
@@ -225,25 +440,82 @@ class PatientTracker:
         return None
     
     def store_location(self, location):
-        """Store location data in database"""
+        """Queue location data for the database writer; returns False if skipped as unmoved"""
+        lat = location.get('latitude')
+        lon = location.get('longitude')
+        now = time.monotonic()
+        if self._last_stored is not None:
+            last_lat, last_lon, last_t = self._last_stored
+            # Same flat-earth scale as the geofence check; the patient stays near its center
+            moved = hypot((lon - last_lon) * self._m_per_deg_lon,
+                          (lat - last_lat) * self._m_per_deg_lat)
+            if moved < self.min_move_distance and now - last_t < self.heartbeat_interval:
+                return False
+        self._last_stored = (lat, lon, now)
+        self._queue_write(INSERT_LOCATION_SQL, (
+            self.patient_id,
+            lat,
+            lon,
+            location.get('altitude'),
+            location.get('speed'),
+            location.get('timestamp'),
+            location.get('accuracy', 10.0)
+        ))
+        return True
+    
+    def _queue_write(self, sql, params):
+        """Hand a row to the writer thread; when full, the oldest row is dropped"""
+        while True:
+            try:
+                self._wqueue.put_nowait((sql, params))
+                return
+            except queue.Full:
+                try:
+                    self._wqueue.get_nowait()
+                except queue.Empty:
+                    pass
+    
+    def db_writer_loop(self):
+        """Commit queued rows in batches; a None item flushes and stops the thread"""
+        batch = []
+        deadline = time.monotonic() + self._flush_interval
+        while True:
+            try:
+                item = self._wqueue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = ()  # flush interval elapsed
+            if item:
+                batch.append(item)
+            try:
+                while item and len(batch) < 64:
+                    item = self._wqueue.get_nowait()
+                    if item:
+                        batch.append(item)
+            except queue.Empty:
+                pass
+            # Alerts are committed at once, together with the fixes queued before them
+            if (item is None or item == () or len(batch) >= self._flush_threshold or
+                    any(sql is INSERT_ALERT_SQL for sql, _ in batch)):
+                self._write_batch(batch)
+                batch = []
+                deadline = time.monotonic() + self._flush_interval
+            if item is None:
+                return
+    
+    def _write_batch(self, batch):
+        """Insert a batch of queued rows in one transaction"""
+        if not batch:
+            return
         try:
-            cursor = self.db_conn.cursor()
-            cursor.execute('''
-                INSERT INTO locations 
-                (patient_id, latitude, longitude, altitude, speed, timestamp, accuracy)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                self.patient_id,
-                location.get('latitude'),
-                location.get('longitude'),
-                location.get('altitude'),
-                location.get('speed'),
-                location.get('timestamp'),
-                location.get('accuracy', 10.0)
-            ))
-            self.db_conn.commit()
+            with self.db_conn:
+                for sql, rows in groupby(batch, key=lambda item: item[0]):
+                    self._cur.executemany(sql, [params for _, params in rows])
         except Exception as e:
             print(f"Database storage error: {e}")
+
+    def _haversine_distance(self, lat, lon):
+        """Great-circle distance in meters from the geofence center"""
+        return _haversine_m(lat, lon, self.geofence_lat, self.geofence_lon)
     
     def check_geofence(self, location):
         """Check if patient is within geofence"""
@@ -251,20 +523,14 @@ class PatientTracker:
             return True
         
         try:
-            import math
-            
-            lat1 = math.radians(location['latitude'])
-            lon1 = math.radians(location['longitude'])
-            lat2 = math.radians(self.geofence_lat)
-            lon2 = math.radians(self.geofence_lon)
-            
-            # Haversine formula
-            dlat = lat2 - lat1
-            dlon = lon2 - lon1
-            a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-            c = 2 * math.asin(math.sqrt(a))
-            r = 6371  # Earth's radius in km
-            distance = c * r * 1000  # Convert to meters
+            lat = location['latitude']
+            lon = location['longitude']
+            if self._gf_haversine:
+                distance = self._haversine_distance(lat, lon)
+            else:
+                dx = (lon - self.geofence_lon) * self._m_per_deg_lon
+                dy = (lat - self.geofence_lat) * self._m_per_deg_lat
+                distance = hypot(dx, dy)
             
             if distance > self.geofence_radius:
                 self.trigger_alert('GEOFENCE_BREACH', 
@@ -286,81 +552,128 @@ class PatientTracker:
             print(f"   Location: {latitude:.6f}, {longitude:.6f}")
             print(f"   Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
             
-            # Store alert in database
-            cursor = self.db_conn.cursor()
-            cursor.execute('''
-                INSERT INTO alerts 
-                (patient_id, alert_type, message, latitude, longitude, timestamp)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (self.patient_id, alert_type, message, latitude, longitude, datetime.now()))
-            self.db_conn.commit()
+            # Store alert in database, committed together with the fixes before it
+            self._queue_write(INSERT_ALERT_SQL, (self.patient_id, alert_type, message, latitude, longitude, datetime.now(timezone.utc)))
             
-            # Send SMS alerts
-            for number in self.emergency_numbers:
-                print(f"   Sending SMS to {number}...")
-                self.send_sms_alert(number, f"ALERT: {message}")
+            # Send SMS alerts in one modem session
+            results = self.send_sms_alert(self.emergency_numbers, f"ALERT: {message}")
+            for number, sent in results.items():
+                if sent:
+                    print(f"   ✓ SMS sent to {number}")
+                else:
+                    print(f"   ✗ SMS to {number} failed")
             
         except Exception as e:
             print(f"Alert triggering failed: {e}")
     
-    def send_sms_alert(self, phone_number, message):
-        """Send SMS alert via GSM module"""
+    def send_sms_alert(self, phone_numbers, message):
+        """Send SMS alert via GSM module; returns {number: sent}"""
+        if isinstance(phone_numbers, str):
+            phone_numbers = [phone_numbers]
+        results = dict.fromkeys(phone_numbers, False)
         try:
-            self.send_gsm_command(f'AT+CMGS="{phone_number}"', wait_time=2)
-            self.gsm_serial.write((message + '\x1A').encode())
-            time.sleep(2)
-            response = self.send_gsm_command('', wait_time=2)
-            print(f"   ✓ SMS sent to {phone_number}")
+            body = message.encode() + SMS_TERMINATOR  # one write per body
+            for number in phone_numbers:
+                # Next recipient goes out as soon as the previous send is acknowledged
+                prompt = self.send_gsm_command(f'AT+CMGS="{number}"', wait_time=5, expect=b'>')
+                if '>' not in prompt:
+                    continue
+                self.gsm_serial.write(body)
+                # Network delivery is slow and silent; don't stop on a quiet line
+                response = self._read_gsm_response(60, expect=b'OK\r', quiet=None)
+                results[number] = '+CMGS:' in response
         except Exception as e:
             print(f"   ✗ SMS sending failed: {e}")
+        return results
+    
+    def write_lines(self, lines):
+        """Write console lines with a single write/flush"""
+        if lines:
+            sys.stdout.write('\n'.join(lines) + '\n')
+            sys.stdout.flush()
     
     def tracking_loop(self):
-        """Main tracking loop with terminal output"""
+        """Main tracking loop with terminal output.
+        
+        One selector serves the GPS and GSM ports as bytes arrive; the
+        status/storage update fires every update_interval.
+        """
         print(f"\n[TRACKING] Starting patient tracking...")
         print(f"   Update interval: {self.update_interval} seconds")
         print(f"   Press Ctrl+C to stop")
         print("-" * 60)
         
-        loop_count = 0
-        while self.is_tracking:
-            try:
-                loop_count += 1
-                print(f"\n[{datetime.now().strftime('%H:%M:%S')}] Update #{loop_count}")
-                
-                # Get GPS location
-                location = self.get_gps_location()
-                
-                if location:
-                    print(f"   📍 Location: {location['latitude']:.6f}, {location['longitude']:.6f}")
+        sel = selectors.DefaultSelector()
+        sel.register(self.gps_serial.fileno(), selectors.EVENT_READ, self._on_gps)
+        if self.gsm_serial:
+            sel.register(self.gsm_serial.fileno(), selectors.EVENT_READ, self._on_gsm)
+        sel.register(self._wake_r, selectors.EVENT_READ, self._on_wake)
+        
+        self._loop_count = 0
+        next_deadline = time.monotonic()
+        try:
+            while self.is_tracking:
+                timeout = next_deadline - time.monotonic()
+                if timeout > 0:
+                    for key, _ in sel.select(timeout):
+                        key.data(key.fd)
+                    continue
+                self._on_tick()
+                # Fixed-rate schedule, so work time doesn't add drift
+                next_deadline += self.update_interval
+                if next_deadline < time.monotonic():
+                    next_deadline = time.monotonic()
+        finally:
+            sel.close()
+    
+    def _on_tick(self):
+        """Report, store and geofence-check the newest fix"""
+        verbose = self.verbose
+        try:
+            self._loop_count += 1
+            now = datetime.now()
+            # Each update's lines are written in one go instead of one print per line
+            out = [f"\n[{now.strftime('%H:%M:%S')}] Update #{self._loop_count}"]
+            
+            # Get GPS location
+            location = self.get_gps_location()
+            
+            if location:
+                out.append(f"   📍 Location: {location['latitude']:.6f}, {location['longitude']:.6f}")
+                if verbose:
                     if location.get('altitude'):
-                        print(f"   🏔️  Altitude: {location['altitude']:.1f}m")
+                        out.append(f"   🏔️  Altitude: {location['altitude']:.1f}m")
                     if location.get('speed'):
-                        print(f"   🚗 Speed: {location['speed']:.1f} knots")
+                        out.append(f"   🚗 Speed: {location['speed']:.1f} knots")
                     if location.get('satellites'):
-                        print(f"   🛰️  Satellites: {location['satellites']}")
-                    
-                    # Store location
-                    self.store_location(location)
-                    print("   💾 Location saved to database")
-                    
-                    # Check geofence
-                    geofence_status = self.check_geofence(location)
-                    if geofence_status:
-                        print("   ✅ Within safe area")
-                    
-                else:
-                    print("   ⚠️  No GPS data available")
-                    print("   📡 Waiting for satellite lock...")
+                        out.append(f"   🛰️  Satellites: {location['satellites']}")
                 
-                # Wait for next update
-                print(f"   ⏳ Next update in {self.update_interval} seconds...")
-                time.sleep(self.update_interval)
+                # Store location
+                stored = self.store_location(location)
+                if verbose:
+                    out.append("   💾 Location saved to database" if stored else
+                               "   💤 Not moved; location not stored")
                 
-            except KeyboardInterrupt:
-                break
-            except Exception as e:
-                print(f"   ✗ Tracking error: {e}")
-                time.sleep(5)
+                # Written before the check so an alert prints after its update
+                self.write_lines(out)
+                out = []
+                
+                # Check geofence
+                geofence_status = self.check_geofence(location)
+                if geofence_status and verbose:
+                    out.append("   ✅ Within safe area")
+                
+            else:
+                out.append("   ⚠️  No GPS data available")
+                if verbose:
+                    out.append("   📡 Waiting for satellite lock...")
+            
+            if verbose:
+                out.append(f"   ⏳ Next update in {self.update_interval} seconds...")
+            self.write_lines(out)
+            
+        except Exception as e:
+            print(f"   ✗ Tracking error: {e}")
     
     def start_tracking(self):
         """Start patient tracking"""
@@ -373,6 +686,7 @@ class PatientTracker:
     def stop_tracking(self):
         """Stop patient tracking"""
         self.is_tracking = False
+        self._wake_w.send(b'\0')
         if hasattr(self, 'tracking_thread'):
             self.tracking_thread.join()
     
@@ -381,6 +695,8 @@ class PatientTracker:
         try:
             print("\n[CLEANUP] Shutting down...")
             self.stop_tracking()
+            self._wake_r.close()
+            self._wake_w.close()
             if self.gps_serial:
                 self.gps_serial.close()
                 print("✓ GPS port closed")
@@ -388,6 +704,11 @@ class PatientTracker:
                 self.gsm_serial.close()
                 print("✓ GSM port closed")
             if self.db_conn:
+                self._wqueue.put(None)
+                self.db_thread.join()
+                # Return up to 1000 free pages to the filesystem (incremental auto_vacuum).
+                # executescript steps the pragma to completion; execute would free one page
+                self.db_conn.executescript('PRAGMA incremental_vacuum(1000)')
                 self.db_conn.close()
                 print("✓ Database closed")
             print("✓ Cleanup completed")
@@ -409,9 +730,9 @@ if __name__ == "__main__":
         tracker = PatientTracker()
         tracker.start_tracking()
         
-        # Keep main thread alive
+        # Keep main thread alive; sleeps until SIGINT runs the handler
         while True:
-            time.sleep(1)
+            pause()
             
     except Exception as e:
         print(f"\n[ERROR] Fatal error: {e}")
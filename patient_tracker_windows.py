@@ -9,9 +9,84 @@ import json
 import sqlite3
 import threading
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
 import random
-import math
+from math import radians, sin, cos, asin, sqrt, hypot
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; the simulation falls back to random
+    np = None
+
+SIM_CHUNK = 4096  # simulated values generated per refill
+
+def _uniform_chunk(low, high, size=SIM_CHUNK):
+    """size uniform floats in [low, high), drawn in one NumPy call when available"""
+    if np is not None:
+        return np.random.uniform(low, high, size).tolist()
+    return [random.uniform(low, high) for _ in range(size)]
+
+# Statement text is kept constant so sqlite3's statement cache reuses the compiled form
+INSERT_LOCATION_SQL = '''
+    INSERT INTO locations 
+    (patient_id, latitude, longitude, altitude, speed, timestamp, accuracy)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+INSERT_ALERT_SQL = '''
+    INSERT INTO alerts 
+    (patient_id, alert_type, message, latitude, longitude, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+# Every table and index in one script, created in a single transaction
+SCHEMA_SQL = '''
+    BEGIN;
+
+    CREATE TABLE IF NOT EXISTS locations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id TEXT,
+        latitude REAL,
+        longitude REAL,
+        altitude REAL,
+        speed REAL,
+        timestamp DATETIME,
+        accuracy REAL
+    );
+
+    CREATE TABLE IF NOT EXISTS alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id TEXT,
+        alert_type TEXT,
+        message TEXT,
+        latitude REAL,
+        longitude REAL,
+        timestamp DATETIME,
+        resolved BOOLEAN DEFAULT 0
+    );
+
+    CREATE TABLE IF NOT EXISTS system_status (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        component TEXT,
+        status TEXT,
+        message TEXT,
+        timestamp DATETIME
+    );
+
+    -- Latest-fixes and open-alerts lookups per patient
+    CREATE INDEX IF NOT EXISTS idx_loc_patient_time
+    ON locations(patient_id, timestamp DESC);
+
+    CREATE INDEX IF NOT EXISTS idx_alerts_patient_time
+    ON alerts(patient_id, timestamp DESC) WHERE resolved = 0;
+
+    COMMIT;
+'''
+
+def adapt_utc(value):
+    """Store datetimes as fixed-width UTC text, so string order is time order"""
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%fZ')
+
+sqlite3.register_adapter(datetime, adapt_utc)
 
 class MockSerial:
     """Mock serial port for testing"""
@@ -21,6 +96,16 @@ class MockSerial:
         self.timeout = timeout
         self.in_waiting = 0
         self.buffer = ""
+        self._gga_tails = []  # pre-formatted sentence bodies after the time field
+        self._idx = 0
+        
+    def _refill(self):
+        """Generate the next chunk of simulated GGA positions"""
+        lats = _uniform_chunk(40.7128 - 0.001, 40.7128 + 0.001)
+        lons = _uniform_chunk(-74.0060 - 0.001, -74.0060 + 0.001)
+        self._gga_tails = [f",{lat:.4f},N,{lon:.4f},W,1,08,0.9,10.0,M,46.9,M,,*47\r\n"
+                           for lat, lon in zip(lats, lons)]
+        self._idx = 0
         
     def write(self, data):
         pass
@@ -28,8 +113,11 @@ class MockSerial:
     def read(self, size):
         # Simulate GPS NMEA data
         if "COM1" in self.port:  # GPS
-            nmea = f"$GPGGA,{datetime.now().strftime('%H%M%S')},{40.7128 + random.uniform(-0.001, 0.001):.4f},{'N'},{-74.0060 + random.uniform(-0.001, 0.001):.4f},{'W'},1,08,0.9,10.0,M,46.9,M,,*47\r\n"
-            return nmea.encode()
+            if self._idx >= len(self._gga_tails):
+                self._refill()
+            tail = self._gga_tails[self._idx]
+            self._idx += 1
+            return f"$GPGGA,{datetime.now().strftime('%H%M%S')}{tail}".encode()
         return b""
         
     def close(self):
@@ -46,14 +134,21 @@ class PatientTrackerWindows:
         
         # Database
         self.db_conn = None
+        self._pending_locations = []  # location rows not yet committed
+        self._flush_threshold = 20  # rows per commit
+        self._flush_interval = 60  # seconds; upper bound on unsaved fixes
+        self._last_flush = time.monotonic()
         
         # Tracking state
         self.is_tracking = False
         self.current_location = None
+        self._sim_fixes = []  # (lat, lon, alt) served by the mock parser
+        self._sim_idx = 0
         self.patient_id = self.config.get('patient_id', 'PATIENT001')
         
         # Setup logging
         self.setup_logging()
+        self.prepare_geofence()
         
         # Initialize components
         self.initialize_database()
@@ -86,6 +181,16 @@ class PatientTrackerWindows:
                 json.dump(default_config, f, indent=4)
             return default_config
     
+    def prepare_geofence(self):
+        """Precompute the geofence's local meters-per-degree scale from the config"""
+        geofence = self.config['geofence']
+        self._gf_lat_rad = radians(geofence['latitude'])
+        self._gf_cos_lat = cos(self._gf_lat_rad)
+        self._m_per_deg_lat = radians(6371000)  # same sphere as the Haversine path
+        self._m_per_deg_lon = self._m_per_deg_lat * self._gf_cos_lat
+        # Flat-earth distance is exact to millimeters at small radii; use Haversine beyond 5 km
+        self._gf_haversine = geofence['radius'] > 5000
+    
     def setup_logging(self):
         """Setup logging configuration"""
         logging.basicConfig(
@@ -101,47 +206,30 @@ class PatientTrackerWindows:
     def initialize_database(self):
         """Initialize SQLite database for storing location data"""
         try:
-            self.db_conn = sqlite3.connect('patient_tracking.db', check_same_thread=False)
+            db_path = 'patient_tracking.db'
+            self.db_conn = sqlite3.connect(db_path, check_same_thread=False)
             cursor = self.db_conn.cursor()
             
-            # Create tables
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS locations (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patient_id TEXT,
-                    latitude REAL,
-                    longitude REAL,
-                    altitude REAL,
-                    speed REAL,
-                    timestamp DATETIME,
-                    accuracy REAL
-                )
-            ''')
+            # Applies directly to a fresh file; an existing one is rebuilt once to adopt it
+            cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            if cursor.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                cursor.execute('VACUUM')
             
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS alerts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patient_id TEXT,
-                    alert_type TEXT,
-                    message TEXT,
-                    latitude REAL,
-                    longitude REAL,
-                    timestamp DATETIME,
-                    resolved BOOLEAN DEFAULT 0
-                )
-            ''')
+            # WAL appends each commit instead of journalling pages twice
+            if db_path != ':memory:':
+                journal_mode = cursor.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+                if journal_mode.lower() != 'wal':
+                    self.logger.warning(f"WAL mode unavailable, using {journal_mode} journal")
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.execute('PRAGMA busy_timeout=5000')
+            cursor.execute('PRAGMA temp_store=MEMORY')
+            cursor.execute('PRAGMA cache_size=-4000')  # 4 MB
             
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS system_status (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    component TEXT,
-                    status TEXT,
-                    message TEXT,
-                    timestamp DATETIME
-                )
-            ''')
+            # Create tables and indexes
+            cursor.executescript(SCHEMA_SQL)
             
-            self.db_conn.commit()
+            # Reused by every write instead of a fresh cursor per call
+            self._cur = cursor
             self.logger.info("Database initialized successfully")
             
         except Exception as e:
@@ -190,12 +278,19 @@ class PatientTrackerWindows:
         try:
             # Simple parsing for demo
             if "$GPGGA" in gps_data:
-                # Generate mock location data
+                # Generate mock location data from a pre-drawn chunk
+                if self._sim_idx >= len(self._sim_fixes):
+                    self._sim_fixes = list(zip(_uniform_chunk(40.7128 - 0.01, 40.7128 + 0.01),
+                                               _uniform_chunk(-74.0060 - 0.01, -74.0060 + 0.01),
+                                               _uniform_chunk(5.0, 15.0)))
+                    self._sim_idx = 0
+                lat, lon, alt = self._sim_fixes[self._sim_idx]
+                self._sim_idx += 1
                 return {
-                    'latitude': 40.7128 + random.uniform(-0.01, 0.01),
-                    'longitude': -74.0060 + random.uniform(-0.01, 0.01),
-                    'altitude': 10.0 + random.uniform(-5, 5),
-                    'timestamp': datetime.now(),
+                    'latitude': lat,
+                    'longitude': lon,
+                    'altitude': alt,
+                    'timestamp': datetime.now(timezone.utc),
                     'fix_quality': 1,
                     'satellites': 8
                 }
@@ -217,25 +312,42 @@ class PatientTrackerWindows:
         return None
     
     def store_location(self, location):
-        """Store location data in database"""
+        """Queue location data, committing to the database in batches"""
+        self._pending_locations.append((
+            self.patient_id,
+            location.get('latitude'),
+            location.get('longitude'),
+            location.get('altitude'),
+            location.get('speed', 0.0),
+            location.get('timestamp'),
+            location.get('accuracy', 10.0)
+        ))
+        if (len(self._pending_locations) >= self._flush_threshold or
+                time.monotonic() - self._last_flush >= self._flush_interval):
+            self._flush_locations()
+    
+    def _insert_pending_locations(self):
+        """Insert queued location rows; the caller owns the transaction"""
+        if self._pending_locations:
+            self._cur.executemany(INSERT_LOCATION_SQL, self._pending_locations)
+            self._pending_locations.clear()
+        self._last_flush = time.monotonic()
+    
+    def _flush_locations(self):
+        """Commit all queued location rows in one transaction"""
         try:
-            cursor = self.db_conn.cursor()
-            cursor.execute('''
-                INSERT INTO locations 
-                (patient_id, latitude, longitude, altitude, speed, timestamp, accuracy)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                self.patient_id,
-                location.get('latitude'),
-                location.get('longitude'),
-                location.get('altitude'),
-                location.get('speed', 0.0),
-                location.get('timestamp'),
-                location.get('accuracy', 10.0)
-            ))
-            self.db_conn.commit()
+            with self.db_conn:
+                self._insert_pending_locations()
         except Exception as e:
             self.logger.error(f"Database storage error: {e}")
+
+    def _haversine_distance(self, lat, lon):
+        """Great-circle distance in meters from the geofence center"""
+        lat1 = radians(lat)
+        dlat = self._gf_lat_rad - lat1
+        dlon = radians(self.config['geofence']['longitude'] - lon)
+        a = sin(dlat/2)**2 + cos(lat1) * self._gf_cos_lat * sin(dlon/2)**2
+        return 2 * 6371000 * asin(sqrt(a))
     
     def check_geofence(self, location):
         """Check if patient is within geofence"""
@@ -243,18 +355,15 @@ class PatientTrackerWindows:
             return True
         
         try:
-            lat1 = math.radians(location['latitude'])
-            lon1 = math.radians(location['longitude'])
-            lat2 = math.radians(self.config['geofence']['latitude'])
-            lon2 = math.radians(self.config['geofence']['longitude'])
-            
-            # Haversine formula
-            dlat = lat2 - lat1
-            dlon = lon2 - lon1
-            a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-            c = 2 * math.asin(math.sqrt(a))
-            r = 6371  # Earth's radius in km
-            distance = c * r * 1000  # Convert to meters
+            geofence = self.config['geofence']
+            lat = location['latitude']
+            lon = location['longitude']
+            if self._gf_haversine:
+                distance = self._haversine_distance(lat, lon)
+            else:
+                dx = (lon - geofence['longitude']) * self._m_per_deg_lon
+                dy = (lat - geofence['latitude']) * self._m_per_deg_lat
+                distance = hypot(dx, dy)
             
             if distance > self.config['geofence']['radius']:
                 self.trigger_alert('GEOFENCE_BREACH', 
@@ -271,14 +380,10 @@ class PatientTrackerWindows:
     def trigger_alert(self, alert_type, message, latitude, longitude):
         """Trigger alert and send notifications (mock)"""
         try:
-            # Store alert in database
-            cursor = self.db_conn.cursor()
-            cursor.execute('''
-                INSERT INTO alerts 
-                (patient_id, alert_type, message, latitude, longitude, timestamp)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (self.patient_id, alert_type, message, latitude, longitude, datetime.now()))
-            self.db_conn.commit()
+            # Store alert in database, committed together with the fixes before it
+            with self.db_conn:
+                self._insert_pending_locations()
+                self._cur.execute(INSERT_ALERT_SQL, (self.patient_id, alert_type, message, latitude, longitude, datetime.now(timezone.utc)))
             
             # Mock SMS alerts
             for number in self.config['emergency_numbers']:
@@ -293,6 +398,7 @@ class PatientTrackerWindows:
         """Main tracking loop"""
         self.logger.info("Starting patient tracking...")
         
+        next_deadline = time.monotonic()
         while self.is_tracking:
             try:
                 # Get GPS location
@@ -309,14 +415,18 @@ class PatientTrackerWindows:
                 else:
                     self.logger.warning("No GPS data available")
                 
-                # Wait for next update
-                time.sleep(self.config['update_interval'])
-                
             except KeyboardInterrupt:
                 break
             except Exception as e:
                 self.logger.error(f"Tracking loop error: {e}")
-                time.sleep(5)
+            
+            # Wait for next update on a fixed-rate schedule, so work time doesn't add drift
+            next_deadline += self.config['update_interval']
+            sleep_for = next_deadline - time.monotonic()
+            if sleep_for > 0:
+                time.sleep(sleep_for)
+            else:
+                next_deadline = time.monotonic()
     
     def start_tracking(self):
         """Start patient tracking"""
@@ -343,6 +453,10 @@ class PatientTrackerWindows:
             if self.gsm_port:
                 self.gsm_port.close()
             if self.db_conn:
+                self._flush_locations()
+                # Return up to 1000 free pages to the filesystem (incremental auto_vacuum).
+                # executescript steps the pragma to completion; execute would free one page
+                self.db_conn.executescript('PRAGMA incremental_vacuum(1000)')
                 self.db_conn.close()
             self.logger.info("Cleanup completed")
         except Exception as e:
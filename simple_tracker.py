@@ -8,9 +8,68 @@ import serial
 import time
 import sqlite3
 import threading
-from datetime import datetime
-import pynmea2
+import queue
+import re
+import selectors
+from datetime import datetime, timezone
 import math
+import logging
+
+try:
+    import pynmea2
+except ImportError:  # pynmea2 is optional; only used for sentences the regex can't read
+    pynmea2 = None
+
+# Latitude/longitude groups of a $GPGGA sentence, matched on the raw serial bytes
+_GGA = re.compile(rb'\$GPGGA,[^,]*,(\d{2})(\d+\.\d+),([NS]),(\d{3})(\d+\.\d+),([EW]),')
+
+# Statement text is kept constant so sqlite3's statement cache reuses the compiled form
+INSERT_LOCATION_SQL = '''
+    INSERT INTO locations (patient_id, lat_e7, lon_e7, timestamp)
+    VALUES (?, ?, ?, ?)
+'''
+
+# Fixed-point coordinates: 1e-7 degrees (~1cm) fits SQLite's 4-byte
+# integer encoding, half the size of a REAL
+LOCATION_INT_COLUMNS = (
+    ('lat_e7', 'INTEGER'),
+    ('lon_e7', 'INTEGER'),
+)
+
+def locations_view_sql(columns):
+    """locations_view (what the dashboard reads) over the columns this table has;
+    older rows keep their REAL values, newer rows only fill the integer ones"""
+    def value(real, fixed=None, scale=None):
+        terms = [real] if real in columns else []
+        if fixed in columns:
+            terms.append(f'{fixed} / {scale}')
+        if not terms:
+            return 'NULL'
+        return terms[0] if len(terms) == 1 else f'COALESCE({", ".join(terms)})'
+    return f'''
+        CREATE VIEW IF NOT EXISTS locations_view AS
+        SELECT id, patient_id,
+               {value('latitude', 'lat_e7', '1e7')} AS latitude,
+               {value('longitude', 'lon_e7', '1e7')} AS longitude,
+               {value('altitude', 'alt_mm', '1e3')} AS altitude,
+               {value('speed', 'speed_mms', '1e3')} AS speed,
+               timestamp, {value('accuracy')} AS accuracy
+        FROM locations
+    '''
+
+def adapt_utc(value):
+    """Store datetimes as fixed-width UTC text, so string order is time order"""
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%fZ')
+
+sqlite3.register_adapter(datetime, adapt_utc)
+
+# Per-tick output is DEBUG, so at the default WARNING level it is never formatted
+# and only alerts and errors are written
+log = logging.getLogger('tracker')
+log.setLevel(logging.WARNING)
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter('[%(asctime)s] %(message)s', '%H:%M:%S'))
+log.addHandler(_log_handler)
 
 class SimplePatientTracker:
     def __init__(self):
@@ -29,10 +88,21 @@ class SimplePatientTracker:
         self.geofence_lat = 40.7128
         self.geofence_lon = -74.0060
         self.geofence_radius = 100
+        # Flat-earth geofence with a fixed center: the cosine and squared radius are computed once
+        self._gf_cos_lat = math.cos(math.radians(self.geofence_lat))
+        self._gf_thresh2 = (self.geofence_radius / 6371000.0) ** 2  # radians squared
+        
+        # Locations are committed in batches by a writer thread
+        self.write_batch_size = 32  # rows per commit
+        self.write_interval = 60  # seconds; upper bound on unsaved fixes
+        self._write_q = queue.Queue()
         
         # Initialize
         self.db_conn = None
         self.gps_serial = None
+        self._nmea_buf = bytearray()  # bytes after the last complete sentence
+        self._latest_fix = None  # newest fix not yet reported by a tick
+        self._fix_lock = threading.Lock()
         self.is_tracking = False
         
         # Setup
@@ -42,8 +112,15 @@ class SimplePatientTracker:
     def setup_database(self):
         """Setup SQLite database"""
         try:
-            self.db_conn = sqlite3.connect('patient_tracking.db')
+            self.db_conn = sqlite3.connect('patient_tracking.db', check_same_thread=False)
             cursor = self.db_conn.cursor()
+            # WAL: one sequential log write per commit, and the dashboard can read meanwhile
+            journal_mode = cursor.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+            if journal_mode.lower() != 'wal':
+                cursor.execute('PRAGMA journal_mode=TRUNCATE')  # no shared-memory support here
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.execute('PRAGMA temp_store=MEMORY')
+            cursor.execute('PRAGMA cache_size=-2000')  # 2 MB; keeps the b-tree hot between batches
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS locations (
                     id INTEGER PRIMARY KEY,
@@ -53,7 +130,21 @@ class SimplePatientTracker:
                     timestamp DATETIME
                 )
             ''')
+            # Add the fixed-point columns to databases created before them
+            existing = {row[1] for row in cursor.execute('PRAGMA table_info(locations)')}
+            for name, col_type in LOCATION_INT_COLUMNS:
+                if name not in existing:
+                    cursor.execute(f'ALTER TABLE locations ADD COLUMN {name} {col_type}')
+                    existing.add(name)
+            cursor.execute(locations_view_sql(existing))
+            # Time-window and latest-fix queries (the dashboard's) use this instead of a scan
+            cursor.execute('CREATE INDEX IF NOT EXISTS ix_locations_ts ON locations(timestamp)')
             self.db_conn.commit()
+            # Reused by every batch instead of a fresh cursor per write
+            self._cur = cursor
+            self._writer_thread = threading.Thread(target=self.db_writer_loop)
+            self._writer_thread.daemon = True
+            self._writer_thread.start()
             print("✓ Database ready")
         except Exception as e:
             print(f"✗ Database error: {e}")
@@ -63,6 +154,11 @@ class SimplePatientTracker:
         try:
             print(f"Connecting to GPS on {self.gps_port}...")
             self.gps_serial = serial.Serial(self.gps_port, self.gps_baudrate, timeout=2)
+            try:
+                # ASYNC_LOW_LATENCY: hand each sentence over without the driver's batching delay
+                self.gps_serial.set_low_latency_mode(True)
+            except (AttributeError, ValueError, OSError):
+                pass  # not supported by this driver/platform
             print("✓ GPS connected")
         except Exception as e:
             print(f"✗ GPS error: {e}")
@@ -73,63 +169,125 @@ class SimplePatientTracker:
             exit(1)
     
     def parse_gps(self, data):
-        """Parse GPS data"""
+        """Parse GPS data (raw bytes from the port); the newest fix wins"""
+        # Jump from one $GPGGA to the previous with rfind; other sentences are never touched
+        end = len(data)
+        while True:
+            start = data.rfind(b'$GPGGA', 0, end)
+            if start < 0:
+                break
+            match = _GGA.match(data, start)
+            if match:
+                lat_deg, lat_min, ns, lon_deg, lon_min, ew = match.groups()
+                lat = int(lat_deg) + float(lat_min) / 60
+                lon = int(lon_deg) + float(lon_min) / 60
+                return {
+                    'lat': -lat if ns == b'S' else lat,
+                    'lon': -lon if ew == b'W' else lon,
+                    'time': datetime.now(timezone.utc)
+                }
+            end = start
+        start = data.rfind(b'$GPGGA')
+        if pynmea2 is None or start < 0:
+            return None
         try:
-            for line in data.split('\n'):
-                if line.startswith('$GPGGA'):
-                    msg = pynmea2.parse(line)
-                    return {
-                        'lat': msg.latitude,
-                        'lon': msg.longitude,
-                        'time': datetime.now()
-                    }
+            stop = data.find(b'\n', start)
+            msg = pynmea2.parse(data[start:stop if stop >= 0 else None].decode(errors='ignore').strip())
+            if not msg.lat or not msg.lon:
+                return None  # no fix yet; pynmea2 would report 0.0, 0.0
+            return {
+                'lat': msg.latitude,
+                'lon': msg.longitude,
+                'time': datetime.now(timezone.utc)
+            }
         except:
             pass
         return None
     
-    def get_location(self):
-        """Get GPS location"""
+    def read_gps(self):
+        """Drain the port and parse complete sentences; returns the bytes read"""
+        received = 0
         try:
-            if self.gps_serial.in_waiting > 0:
-                data = self.gps_serial.read(self.gps_serial.in_waiting).decode()
-                return self.parse_gps(data)
+            while self.gps_serial.in_waiting > 0:
+                chunk = self.gps_serial.read(self.gps_serial.in_waiting)
+                received += len(chunk)
+                self._nmea_buf += chunk
+            # Only complete sentences are parsed; a partial one waits for the next read
+            end = self._nmea_buf.rfind(b'\n') + 1
+            if end:
+                data = bytes(self._nmea_buf[:end])
+                del self._nmea_buf[:end]
+                location = self.parse_gps(data)
+                if location:
+                    with self._fix_lock:
+                        self._latest_fix = location
+            elif len(self._nmea_buf) > 4096:
+                self._nmea_buf.clear()  # no line ending in sight; not NMEA
         except Exception as e:
-            print(f"GPS read error: {e}")
-        return None
+            log.error("GPS read error: %s", e)
+        return received
     
-    def save_location(self, location):
-        """Save location to database"""
+    def get_location(self):
+        """Get GPS location: the newest fix since the last call, or None"""
+        with self._fix_lock:
+            location, self._latest_fix = self._latest_fix, None
+        return location
+    
+    def gps_reader_loop(self):
+        """Parse sentences as the module sends them (1Hz), caching the newest fix"""
+        sel = selectors.DefaultSelector()
+        sel.register(self.gps_serial.fileno(), selectors.EVENT_READ)
         try:
-            cursor = self.db_conn.cursor()
-            cursor.execute('''
-                INSERT INTO locations (patient_id, latitude, longitude, timestamp)
-                VALUES (?, ?, ?, ?)
-            ''', (self.patient_id, location['lat'], location['lon'], location['time']))
-            self.db_conn.commit()
-            print(f"✓ Saved: {location['lat']:.6f}, {location['lon']:.6f}")
-        except Exception as e:
-            print(f"Save error: {e}")
+            while self.is_tracking:
+                # The timeout only bounds how long stop() waits for this thread
+                if sel.select(0.5) and not self.read_gps():
+                    time.sleep(0.1)  # port hung up; don't spin on it
+        finally:
+            sel.close()
+    
+    def save_location(self, location):
+        """Queue location for the database writer"""
+        self._write_q.put((self.patient_id, int(round(location['lat'] * 1e7)),
+                           int(round(location['lon'] * 1e7)), location['time']))
+        log.debug("✓ Saved: %.6f, %.6f", location['lat'], location['lon'])
+    
+    def db_writer_loop(self):
+        """Commit queued locations in batches; a None item flushes and stops"""
+        while True:
+            rows = []
+            item = self._write_q.get()
+            deadline = time.monotonic() + self.write_interval
+            while item is not None:
+                rows.append(item)
+                if len(rows) >= self.write_batch_size:
+                    break
+                try:
+                    item = self._write_q.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if rows:
+                try:
+                    with self.db_conn:
+                        self._cur.executemany(INSERT_LOCATION_SQL, rows)
+                except Exception as e:
+                    log.error("Save error: %s", e)
+            if item is None:
+                return
     
     def check_geofence(self, location):
         """Check if within geofence"""
         try:
-            lat1 = math.radians(location['lat'])
-            lon1 = math.radians(location['lon'])
-            lat2 = math.radians(self.geofence_lat)
-            lon2 = math.radians(self.geofence_lon)
-            
-            dlat = lat2 - lat1
-            dlon = lon2 - lon1
-            a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-            c = 2 * math.asin(math.sqrt(a))
-            distance = c * 6371 * 1000  # meters
+            dlat = math.radians(location['lat'] - self.geofence_lat)
+            dlon = math.radians(location['lon'] - self.geofence_lon) * self._gf_cos_lat
+            d2 = dlat * dlat + dlon * dlon
+            distance = math.sqrt(d2) * 6371000  # meters, for the message only
             
-            if distance > self.geofence_radius:
-                print(f"🚨 ALERT: Outside safe area! ({distance:.0f}m)")
+            if d2 > self._gf_thresh2:
+                log.warning("🚨 ALERT: Outside safe area! (%.0fm)", distance)
             else:
-                print(f"✅ Within safe area ({distance:.0f}m)")
+                log.debug("✅ Within safe area (%.0fm)", distance)
         except Exception as e:
-            print(f"Geofence error: {e}")
+            log.error("Geofence error: %s", e)
     
     def track_loop(self):
         """Main tracking loop"""
@@ -137,62 +295,67 @@ class SimplePatientTracker:
         print("Press Ctrl+C to stop")
         print("-" * 50)
         
+        # The reader thread parses sentences as they arrive; ticks only take the cached fix
         count = 0
+        next_deadline = time.monotonic()
         while self.is_tracking:
+            timeout = next_deadline - time.monotonic()
+            if timeout > 0:
+                time.sleep(timeout)
+                continue
             try:
                 count += 1
-                print(f"\n[{datetime.now().strftime('%H:%M:%S')}] Update #{count}")
+                log.debug("Update #%d", count)
                 
                 location = self.get_location()
                 if location:
-                    print(f"📍 Location: {location['lat']:.6f}, {location['lon']:.6f}")
+                    log.debug("📍 Location: %.6f, %.6f", location['lat'], location['lon'])
                     self.save_location(location)
                     self.check_geofence(location)
                 else:
-                    print("⚠️  No GPS signal")
-                    print("📡 Waiting for satellites...")
+                    log.debug("⚠️  No GPS signal; waiting for satellites...")
                 
-                print(f"⏳ Next update in {self.update_interval}s...")
-                time.sleep(self.update_interval)
+                log.debug("⏳ Next update in %ss...", self.update_interval)
+                # Fixed-rate schedule, so work time doesn't add drift
+                next_deadline = max(next_deadline + self.update_interval, time.monotonic())
                 
-            except KeyboardInterrupt:
-                break
             except Exception as e:
-                print(f"Error: {e}")
-                time.sleep(5)
+                log.error("Error: %s", e)
+                next_deadline = time.monotonic() + 5
     
     def start(self):
-        """Start tracking"""
+        """Track on the calling thread until Ctrl+C, then stop"""
         self.is_tracking = True
-        self.track_thread = threading.Thread(target=self.track_loop)
-        self.track_thread.daemon = True
-        self.track_thread.start()
+        self._reader_thread = threading.Thread(target=self.gps_reader_loop, daemon=True)
+        self._reader_thread.start()
+        try:
+            self.track_loop()
+        except KeyboardInterrupt:
+            print("\n\nShutting down...")
+        finally:
+            self.stop()
     
     def stop(self):
         """Stop tracking"""
         self.is_tracking = False
-        if hasattr(self, 'track_thread'):
-            self.track_thread.join()
+        if hasattr(self, '_reader_thread'):
+            self._reader_thread.join()
         if self.gps_serial:
             self.gps_serial.close()
         if self.db_conn:
+            if hasattr(self, '_writer_thread'):
+                self._write_q.put(None)
+                self._writer_thread.join()
             self.db_conn.close()
         print("\n✓ Stopped")
 
 if __name__ == "__main__":
     try:
-        tracker = SimplePatientTracker()
-        tracker.start()
-        
-        # Keep running
-        while True:
-            time.sleep(1)
-            
+        # The tracking loop runs on the main thread; Ctrl+C ends it
+        SimplePatientTracker().start()
+        print("Goodbye!")
     except KeyboardInterrupt:
         print("\n\nShutting down...")
-        tracker.stop()
         print("Goodbye!")
     except Exception as e:
         print(f"\nFatal error: {e}")
-        if 'tracker' in locals():
-            tracker.stop()
@@ -7,23 +7,29 @@ sys.path.insert(0, '.')
 from patient_tracker import PatientTracker
 import time
 
-print("Testing GPS fix...")
-print(f"OS: {os.name}")
+def run(tracker=None):
+    """Run the GPS fix check; reuses the caller's tracker when given one"""
+    print("Testing GPS fix...")
+    print(f"OS: {os.name}")
+    
+    # Create tracker instance
+    if tracker is None:
+        tracker = PatientTracker()
+    print(f"GPS Port in config: {tracker.config['gps_port']}")
+    print(f"GSM Port in config: {tracker.config['gsm_port']}")
+    
+    # Test GPS location
+    print("\nTesting GPS location retrieval...")
+    location = tracker.get_gps_location()
+    if location:
+        print(f"✓ GPS location acquired: {location['latitude']:.6f}, {location['longitude']:.6f}")
+        print(f"  Altitude: {location.get('altitude', 'N/A')}")
+        print(f"  Speed: {location.get('speed', 'N/A')}")
+        print(f"  Timestamp: {location['timestamp']}")
+    else:
+        print("✗ No GPS location available")
+    
+    print("\nTest completed successfully!")
 
-# Create tracker instance
-tracker = PatientTracker()
-print(f"GPS Port in config: {tracker.config['gps_port']}")
-print(f"GSM Port in config: {tracker.config['gsm_port']}")
-
-# Test GPS location
-print("\nTesting GPS location retrieval...")
-location = tracker.get_gps_location()
-if location:
-    print(f"✓ GPS location acquired: {location['latitude']:.6f}, {location['longitude']:.6f}")
-    print(f"  Altitude: {location.get('altitude', 'N/A')}")
-    print(f"  Speed: {location.get('speed', 'N/A')}")
-    print(f"  Timestamp: {location['timestamp']}")
-else:
-    print("✗ No GPS location available")
-
-print("\nTest completed successfully!")
+if __name__ == "__main__":
+    run()
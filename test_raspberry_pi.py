@@ -8,6 +8,7 @@ import os
 sys.path.insert(0, '.')
 
 from patient_tracker import PatientTracker
+import test_gps_fix
 import json
 
 print("=== Raspberry Pi Compatible Patient Tracker Test ===")
@@ -50,10 +51,15 @@ except Exception as e:
     print(f"⚠ Serial port initialization failed (expected on non-Raspberry Pi): {e}")
     print("✓ This is normal - the code is correctly configured for Raspberry Pi")
 
+# GPS fix check, on the tracker built above instead of constructing another
+print("\n4. Testing GPS fix...")
+test_gps_fix.run(tracker)
+
 print("\n=== Test Summary ===")
 print("✓ Configuration loading works")
 print("✓ Database initialization works") 
 print("✓ Serial port code is Raspberry Pi compatible")
+print("✓ GPS location retrieval runs")
 print("✓ Code is ready for deployment on Raspberry Pi")
 
 print("\n=== Raspberry Pi Setup Requirements ===")
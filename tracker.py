@@ -7,7 +7,8 @@ import serial
 import time
 import sqlite3
 import threading
-from datetime import datetime
+import queue
+from datetime import datetime, timezone
 import math
 
 print("=" * 50)
@@ -24,17 +25,65 @@ UPDATE_INTERVAL = 10
 SAFE_LAT = 40.7128
 SAFE_LON = -74.0060
 SAFE_RADIUS = 100  # meters
+# Flat-earth geofence: at this radius the projection error is far below GPS noise
+_COS_SAFE_LAT = math.cos(math.radians(SAFE_LAT))  # the center is fixed; computed once
+_THRESH2 = (SAFE_RADIUS / 6371000.0) ** 2  # squared radius, in radians
+
+# Locations are committed in batches by a writer thread
+WRITE_BATCH = 32  # rows per commit
+WRITE_INTERVAL = 60  # seconds; upper bound on unsaved fixes
+
+# Statement text is kept constant so sqlite3's statement cache reuses the compiled form
+INSERT_LOCATION_SQL = '''
+    INSERT INTO locations (patient, lat_e7, lon_e7, time)
+    VALUES (?, ?, ?, ?)
+'''
+
+# Fixed-point coordinates: 1e-7 degrees (~1cm) fits SQLite's 4-byte
+# integer encoding, half the size of a REAL
+LOCATION_INT_COLUMNS = (
+    ('lat_e7', 'INTEGER'),
+    ('lon_e7', 'INTEGER'),
+)
+
+# Older rows keep their REAL values; newer rows only fill the integer columns
+CREATE_LOCATIONS_VIEW_SQL = '''
+    CREATE VIEW IF NOT EXISTS locations_view AS
+    SELECT id, patient,
+           COALESCE(lat, lat_e7 / 1e7) AS lat,
+           COALESCE(lon, lon_e7 / 1e7) AS lon,
+           time
+    FROM locations
+'''
+
+def adapt_utc(value):
+    """Store datetimes as fixed-width UTC text, so string order is time order"""
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%fZ')
+
+sqlite3.register_adapter(datetime, adapt_utc)
 
 # Initialize
 db = None
+cur = None  # reused by every batch instead of a fresh cursor per write
 gps = None
 running = False
+nmea_buf = bytearray()  # bytes after the last complete sentence
+stop_event = threading.Event()  # wakes the loop's waits on cleanup()
+write_q = queue.Queue()
+writer = None
 
 def setup_db():
     """Setup database"""
-    global db
+    global db, cur, writer
     try:
-        db = sqlite3.connect('patient.db')
+        db = sqlite3.connect('patient.db', check_same_thread=False)
+        # WAL: one sequential log write per commit, and readers aren't blocked
+        journal_mode = db.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+        if journal_mode.lower() != 'wal':
+            db.execute('PRAGMA journal_mode=TRUNCATE')  # no shared-memory support here
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute('PRAGMA temp_store=MEMORY')
+        db.execute('PRAGMA cache_size=-2000')  # 2 MB; keeps the b-tree hot between batches
         db.execute('''
             CREATE TABLE IF NOT EXISTS locations (
                 id INTEGER PRIMARY KEY,
@@ -44,7 +93,18 @@ def setup_db():
                 time DATETIME
             )
         ''')
+        # Add the fixed-point columns to databases created before them
+        existing = {row[1] for row in db.execute('PRAGMA table_info(locations)')}
+        for name, col_type in LOCATION_INT_COLUMNS:
+            if name not in existing:
+                db.execute(f'ALTER TABLE locations ADD COLUMN {name} {col_type}')
+        db.execute(CREATE_LOCATIONS_VIEW_SQL)
+        # Time-window queries use this instead of a scan
+        db.execute('CREATE INDEX IF NOT EXISTS ix_locations_time ON locations(time)')
         db.commit()
+        cur = db.cursor()
+        writer = threading.Thread(target=db_writer_loop, daemon=True)
+        writer.start()
         print("✓ Database ready")
         return True
     except Exception as e:
@@ -57,6 +117,11 @@ def setup_gps():
     try:
         print(f"Connecting GPS to {GPS_PORT}...")
         gps = serial.Serial(GPS_PORT, GPS_BAUD, timeout=2)
+        try:
+            # ASYNC_LOW_LATENCY: hand each sentence over without the driver's batching delay
+            gps.set_low_latency_mode(True)
+        except (AttributeError, ValueError, OSError):
+            pass  # not supported by this driver/platform
         print("✓ GPS connected")
         return True
     except Exception as e:
@@ -65,18 +130,41 @@ def setup_gps():
         print("     sudo python3 tracker.py")
         return False
 
+def nmea_ok(sentence):
+    """Check the *XX suffix: XOR of the bytes between '$' and '*'"""
+    star = sentence.rfind(b'*')
+    if star < 1:
+        return False
+    checksum = 0
+    for byte in sentence[1:star]:
+        checksum ^= byte
+    try:
+        return checksum == int(sentence[star + 1:star + 3], 16)
+    except ValueError:
+        return False
+
 def parse_nmea(data):
-    """Parse GPS data"""
+    """Parse GPS data (raw bytes); the newest fix wins"""
     try:
-        for line in data.split('\n'):
-            if line.startswith('$GPGGA'):
-                parts = line.split(',')
-                if len(parts) > 5 and parts[2] and parts[4]:
-                    lat = float(parts[2][:2]) + float(parts[2][2:]) / 60
-                    if parts[3] == 'S': lat = -lat
-                    lon = float(parts[4][:3]) + float(parts[4][3:]) / 60
-                    if parts[5] == 'W': lon = -lon
-                    return {'lat': lat, 'lon': lon, 'time': datetime.now()}
+        # Walk back from the newest $GPGGA; other sentences are never split or copied
+        end = len(data)
+        while True:
+            start = data.rfind(b'$GPGGA', 0, end)
+            if start < 0:
+                return None
+            stop = data.find(b'\n', start, end)
+            line = data[start:stop if stop >= 0 else end].rstrip()
+            end = start
+            # Corrupt or partial frames are dropped before any float parsing
+            if not nmea_ok(line):
+                continue
+            parts = line.split(b',')
+            if len(parts) > 5 and parts[2] and parts[4]:
+                lat = float(parts[2][:2]) + float(parts[2][2:]) / 60
+                if parts[3] == b'S': lat = -lat
+                lon = float(parts[4][:3]) + float(parts[4][3:]) / 60
+                if parts[5] == b'W': lon = -lon
+                return {'lat': lat, 'lon': lon, 'time': datetime.now(timezone.utc)}
     except:
         pass
     return None
@@ -84,40 +172,57 @@ def parse_nmea(data):
 def get_location():
     """Get GPS location"""
     try:
-        if gps.in_waiting > 0:
-            data = gps.read(gps.in_waiting).decode()
+        while gps.in_waiting > 0:
+            nmea_buf.extend(gps.read(gps.in_waiting))
+        # Only complete sentences are parsed; a partial one waits for the next read
+        end = nmea_buf.rfind(b'\n') + 1
+        if end:
+            data = bytes(nmea_buf[:end])
+            del nmea_buf[:end]
             return parse_nmea(data)
+        if len(nmea_buf) > 4096:
+            nmea_buf.clear()  # no line ending in sight; not NMEA
     except:
         pass
     return None
 
 def save_location(loc):
-    """Save to database"""
-    try:
-        db.execute('''
-            INSERT INTO locations (patient, lat, lon, time)
-            VALUES (?, ?, ?, ?)
-        ''', (PATIENT_ID, loc['lat'], loc['lon'], loc['time']))
-        db.commit()
-        print(f"✓ Saved: {loc['lat']:.6f}, {loc['lon']:.6f}")
-    except Exception as e:
-        print(f"Save error: {e}")
+    """Queue for the database writer"""
+    write_q.put((PATIENT_ID, int(round(loc['lat'] * 1e7)), int(round(loc['lon'] * 1e7)), loc['time']))
+    print(f"✓ Saved: {loc['lat']:.6f}, {loc['lon']:.6f}")
+
+def db_writer_loop():
+    """Commit queued locations in batches; a None item flushes and stops"""
+    while True:
+        rows = []
+        item = write_q.get()
+        deadline = time.monotonic() + WRITE_INTERVAL
+        while item is not None:
+            rows.append(item)
+            if len(rows) >= WRITE_BATCH:
+                break
+            try:
+                item = write_q.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+        if rows:
+            try:
+                with db:
+                    cur.executemany(INSERT_LOCATION_SQL, rows)
+            except Exception as e:
+                print(f"Save error: {e}")
+        if item is None:
+            return
 
 def check_geofence(loc):
     """Check if within safe area"""
     try:
-        lat1 = math.radians(loc['lat'])
-        lon1 = math.radians(loc['lon'])
-        lat2 = math.radians(SAFE_LAT)
-        lon2 = math.radians(SAFE_LON)
-        
-        dlat = lat2 - lat1
-        dlon = lon2 - lon1
-        a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-        c = 2 * math.asin(math.sqrt(a))
-        distance = c * 6371 * 1000  # meters
+        dlat = math.radians(loc['lat'] - SAFE_LAT)
+        dlon = math.radians(loc['lon'] - SAFE_LON) * _COS_SAFE_LAT
+        d2 = dlat * dlat + dlon * dlon
+        distance = math.sqrt(d2) * 6371000  # meters, for the message only
         
-        if distance > SAFE_RADIUS:
+        if d2 > _THRESH2:
             print(f"🚨 ALERT: Outside safe area! ({distance:.0f}m)")
         else:
             print(f"✅ Safe ({distance:.0f}m from center)")
@@ -128,6 +233,7 @@ def tracking_loop():
     """Main tracking loop"""
     global running
     count = 0
+    next_deadline = time.monotonic()
     
     print(f"\nTracking started (every {UPDATE_INTERVAL}s)")
     print("Press Ctrl+C to stop")
@@ -148,22 +254,29 @@ def tracking_loop():
                 print("📡 Waiting for satellites...")
             
             print(f"⏳ {UPDATE_INTERVAL}s...")
-            time.sleep(UPDATE_INTERVAL)
+            # Fixed-rate schedule, so work time doesn't add drift
+            next_deadline = max(next_deadline + UPDATE_INTERVAL, time.monotonic())
+            stop_event.wait(next_deadline - time.monotonic())
             
         except KeyboardInterrupt:
             break
         except Exception as e:
             print(f"Error: {e}")
-            time.sleep(5)
+            stop_event.wait(5)
+            next_deadline = time.monotonic()
 
 def cleanup():
     """Cleanup"""
     global running, gps, db
     running = False
+    stop_event.set()
     if gps:
         gps.close()
         print("✓ GPS closed")
     if db:
+        if writer:
+            write_q.put(None)
+            writer.join()
         db.close()
         print("✓ Database closed")
 
@@ -4,20 +4,115 @@ Web Dashboard for Patient Tracking System
 Provides real-time visualization of patient location and alerts
 """
 
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request, stream_with_context
 import sqlite3
 import json
-from datetime import datetime, timedelta
+import os
+import threading
+from datetime import datetime, timedelta, timezone
 import math
 
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; batch distances fall back to math
+    np = None
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; streamed rows are encoded with json
+    orjson = None
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; distances use NumPy/math directly
+    njit = None
+
 app = Flask(__name__)
 
+def adapt_utc(value):
+    """Bind datetimes as fixed-width UTC text, so string order is time order"""
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%fZ')
+
+sqlite3.register_adapter(datetime, adapt_utc)
+
+# One connection per worker thread, kept open so its schema and statement caches are reused.
+# That only pays off with long-lived worker threads (gunicorn's gthread workers); the
+# development server starts a new thread per request, so there each request connects afresh.
+_local = threading.local()
+
 def get_db_connection():
-    """Get database connection"""
-    conn = sqlite3.connect('patient_tracking.db')
-    conn.row_factory = sqlite3.Row
+    """Get this thread's database connection, opened on first use"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect('patient_tracking.db', check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        # The journal mode is the trackers' to choose; a WAL database needs no setup here
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        _local.conn = conn
+    ensure_indexes(conn)
     return conn
 
+# Indexes the dashboard queries rely on, whichever tracker created the tables
+DASHBOARD_INDEXES = (
+    ('locations', 'CREATE INDEX IF NOT EXISTS ix_locations_ts ON locations(timestamp)'),
+    ('alerts', 'CREATE INDEX IF NOT EXISTS ix_alerts_resolved_ts ON alerts(resolved, timestamp DESC)'),
+)
+
+_indexes_ready = False
+
+def ensure_indexes(conn):
+    """Create the dashboard's indexes once per process, for tables that exist"""
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    with conn:
+        for table, sql in DASHBOARD_INDEXES:
+            if table in tables:
+                conn.execute(sql)
+    _indexes_ready = {'locations', 'alerts'} <= tables
+
+def rows_to_json(cursor):
+    """Encode query rows as a JSON array one row at a time, without a full list in memory"""
+    dumps = orjson.dumps if orjson is not None else lambda obj: json.dumps(obj).encode()
+    yield b'['
+    separator = b''
+    for row in cursor:
+        yield separator + dumps(dict(row))
+        separator = b','
+    yield b']'
+
+# config.json as last parsed, reloaded only when the file's mtime changes
+_config = None
+_config_mtime = None
+
+def load_config():
+    """Get the parsed config.json, re-reading it only after it has been edited"""
+    global _config, _config_mtime
+    mtime = os.stat('config.json').st_mtime_ns
+    if mtime != _config_mtime:
+        with open('config.json', 'rb') as f:
+            data = f.read()
+        _config = orjson.loads(data) if orjson is not None else json.loads(data)
+        _config_mtime = mtime
+    return _config
+
+_locations_source = None
+
+def locations_source(conn):
+    """Table to read locations from: the fixed-point view when the tracker
+    has created it, otherwise the plain table"""
+    global _locations_source
+    if _locations_source is None:
+        row = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = 'locations_view'"
+        ).fetchone()
+        if row is None:
+            return 'locations'
+        _locations_source = 'locations_view'
+    return _locations_source
+
 def calculate_distance(lat1, lon1, lat2, lon2):
     """Calculate distance between two coordinates in meters"""
     R = 6371000  # Earth's radius in meters
@@ -34,6 +129,42 @@ def calculate_distance(lat1, lon1, lat2, lon2):
     
     return R * c
 
+if njit is not None:
+    # Compiled once (and cached on disk) at the first request that needs it
+    calculate_distance = njit(cache=True, fastmath=True)(calculate_distance)
+
+if njit is not None and np is not None:
+    @njit(cache=True, fastmath=True)
+    def _haversine_arr(lat, lon, c_lat, c_lon):
+        """Haversine distances in meters from (c_lat, c_lon) for 1-D float64 degree arrays"""
+        lat2 = math.radians(c_lat)
+        lon2 = math.radians(c_lon)
+        cos_lat2 = math.cos(lat2)
+        out = np.empty(lat.shape[0])
+        for i in range(lat.shape[0]):
+            lat1 = math.radians(lat[i])
+            a = (math.sin((lat2 - lat1) * 0.5)**2 +
+                 math.cos(lat1) * cos_lat2 *
+                 math.sin((lon2 - math.radians(lon[i])) * 0.5)**2)
+            out[i] = 6371000 * 2 * math.asin(math.sqrt(a))
+        return out
+else:
+    _haversine_arr = None
+
+def vec_haversine(lats, lons, c_lat, c_lon):
+    """Distances in meters from (c_lat, c_lon) to every point, as an ndarray"""
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if _haversine_arr is not None:
+        return _haversine_arr(lats, lons, float(c_lat), float(c_lon))
+    lat1 = np.radians(lats)
+    lon1 = np.radians(lons)
+    lat2 = math.radians(c_lat)
+    a = (np.sin((lat2 - lat1) * 0.5)**2 +
+         np.cos(lat1) * math.cos(lat2) *
+         np.sin((math.radians(c_lon) - lon1) * 0.5)**2)
+    return 6371000 * 2 * np.arcsin(np.sqrt(a))
+
 @app.route('/')
 def dashboard():
     """Main dashboard page"""
@@ -45,14 +176,15 @@ def get_current_location():
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT * FROM locations 
-        ORDER BY timestamp DESC 
+    # rowid order is insertion order, so the newest fix is one b-tree step away
+    cursor.execute(f'''
+        SELECT latitude, longitude, altitude, speed, timestamp, accuracy
+        FROM {locations_source(conn)} 
+        ORDER BY id DESC 
         LIMIT 1
     ''')
     
     location = cursor.fetchone()
-    conn.close()
     
     if location:
         return jsonify({
@@ -74,18 +206,18 @@ def get_location_history():
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    since_time = datetime.now() - timedelta(hours=hours)
+    since_time = datetime.now(timezone.utc) - timedelta(hours=hours)
     
-    cursor.execute('''
-        SELECT * FROM locations 
+    # The bound is sent as the same fixed-width UTC text the trackers store
+    cursor.execute(f'''
+        SELECT id, patient_id, latitude, longitude, altitude, speed, timestamp, accuracy
+        FROM {locations_source(conn)} 
         WHERE timestamp > ?
         ORDER BY timestamp ASC
     ''', (since_time,))
     
-    locations = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    
-    return jsonify(locations)
+    # Streamed straight off the cursor; long windows are never held as a list
+    return Response(stream_with_context(rows_to_json(cursor)), mimetype='application/json')
 
 @app.route('/api/alerts')
 def get_alerts():
@@ -101,7 +233,6 @@ def get_alerts():
     ''')
     
     alerts = [dict(row) for row in cursor.fetchall()]
-    conn.close()
     
     return jsonify(alerts)
 
@@ -120,16 +251,13 @@ def mark_alert_resolved():
     ''', (alert_id,))
     
     conn.commit()
-    conn.close()
     
     return jsonify({'success': True})
 
 @app.route('/api/geofence_status')
 def get_geofence_status():
     """Check geofence status"""
-    # Load config
-    with open('config.json', 'r') as f:
-        config = json.load(f)
+    config = load_config()
     
     geofence = config.get('geofence', {})
     
@@ -140,14 +268,13 @@ def get_geofence_status():
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT * FROM locations 
-        ORDER BY timestamp DESC 
+    cursor.execute(f'''
+        SELECT latitude, longitude FROM {locations_source(conn)} 
+        ORDER BY id DESC 
         LIMIT 1
     ''')
     
     location = cursor.fetchone()
-    conn.close()
     
     if not location:
         return jsonify({'enabled': True, 'status': 'unknown'})
@@ -171,6 +298,53 @@ def get_geofence_status():
         }
     })
 
+@app.route('/api/history_geofence_breaches')
+def get_history_geofence_breaches():
+    """Stored fixes outside the geofence over the last N hours"""
+    hours = request.args.get('hours', 24, type=int)
+    
+    config = load_config()
+    
+    geofence = config.get('geofence', {})
+    
+    if not geofence.get('enabled', False):
+        return jsonify({'enabled': False})
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    since_time = datetime.now(timezone.utc) - timedelta(hours=hours)
+    
+    cursor.execute(f'''
+        SELECT latitude, longitude, timestamp FROM {locations_source(conn)} 
+        WHERE timestamp > ?
+        ORDER BY timestamp ASC
+    ''', (since_time,))
+    
+    rows = cursor.fetchall()
+    
+    # One vectorized pass over the whole window when numpy is available
+    if np is not None and rows:
+        distances = vec_haversine([row[0] for row in rows], [row[1] for row in rows],
+                                  geofence['latitude'], geofence['longitude']).tolist()
+    else:
+        distances = [calculate_distance(row[0], row[1],
+                                        geofence['latitude'], geofence['longitude'])
+                     for row in rows]
+    
+    breaches = [
+        {'latitude': row[0], 'longitude': row[1], 'timestamp': row[2], 'distance': distance}
+        for row, distance in zip(rows, distances)
+        if distance > geofence['radius']
+    ]
+    
+    return jsonify({
+        'enabled': True,
+        'checked': len(rows),
+        'radius': geofence['radius'],
+        'breaches': breaches
+    })
+
 @app.route('/api/statistics')
 def get_statistics():
     """Get tracking statistics"""
@@ -182,7 +356,7 @@ def get_statistics():
     total_locations = cursor.fetchone()['count']
     
     # Locations in last 24 hours
-    since_24h = datetime.now() - timedelta(hours=24)
+    since_24h = datetime.now(timezone.utc) - timedelta(hours=24)
     cursor.execute('SELECT COUNT(*) as count FROM locations WHERE timestamp > ?', (since_24h,))
     recent_locations = cursor.fetchone()['count']
     
@@ -194,7 +368,6 @@ def get_statistics():
     cursor.execute('SELECT MAX(timestamp) as last_update FROM locations')
     last_update = cursor.fetchone()['last_update']
     
-    conn.close()
     
     return jsonify({
         'total_locations': total_locations,
@@ -204,4 +377,7 @@ def get_statistics():
     })
 
 if __name__ == '__main__':
+    # Development server (a new thread, and so a new connection, per request); for
+    # deployment run a threaded WSGI server so connections are reused, e.g.
+    #   gunicorn -k gthread -w 2 --threads 4 -b 0.0.0.0:5000 web_dashboard:app
     app.run(host='0.0.0.0', port=5000, debug=True)